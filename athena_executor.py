@@ -0,0 +1,155 @@
+
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+import config
+
+
+BATCH_GET_LIMIT = 50          # ids per batch_get_query_execution call
+BACKOFF_FACTOR = 1.5
+FINAL_STATES = ("SUCCEEDED", "FAILED", "CANCELLED")
+
+
+class AthenaExecutor:
+    """Run many Athena queries at once and poll them together.
+
+    submit() returns a Future that resolves to the final QueryExecution
+    dict (check ["Status"]["State"]). A single background thread starts
+    queued queries while fewer than max_concurrency are running, and
+    polls all running ones with batch_get_query_execution. Polling starts
+    at ATHENA_POLL_INITIAL_SECONDS and backs off to ATHENA_POLL_MAX_SECONDS
+    while nothing changes, so short queries don't wait out a fixed 2s.
+    """
+
+    def __init__(self, athena_client=None, max_concurrency=None):
+        self.client = athena_client or boto3.client("athena", region_name=config.REGION)
+        self.max_concurrency = max_concurrency or config.ATHENA_MAX_CONCURRENCY
+        self._queued = deque()
+        self._running = {}
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, query, database=None):
+        """Queue a query; returns a Future of its final QueryExecution."""
+        future = Future()
+        with self._wakeup:
+            if self._closed:
+                raise RuntimeError("AthenaExecutor is shut down")
+            self._queued.append((query, database, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+        return future
+
+    def execute(self, query, database=None):
+        """Run one query and wait for its final QueryExecution."""
+        return self.submit(query, database).result()
+
+    def shutdown(self, wait=True):
+        """Stop accepting queries; optionally wait for the queued ones."""
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def _start(self, query, database, future):
+        """Start one query; False if Athena is throttling (retry later)."""
+        request = {
+            "QueryString": query,
+            "ResultConfiguration": {
+                "OutputLocation": f"s3://{config.BUCKET_NAME}/athena-results/"
+            },
+        }
+        if database:
+            request["QueryExecutionContext"] = {"Database": database}
+        try:
+            response = self.client.start_query_execution(**request)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "TooManyRequestsException":
+                return False
+            future.set_exception(e)
+            return True
+        except Exception as e:
+            future.set_exception(e)
+            return True
+        self._running[response["QueryExecutionId"]] = future
+        return True
+
+    def _poll(self):
+        """Resolve finished queries; returns how many finished."""
+        finished = 0
+        ids = list(self._running)
+        for i in range(0, len(ids), BATCH_GET_LIMIT):
+            try:
+                response = self.client.batch_get_query_execution(
+                    QueryExecutionIds=ids[i:i + BATCH_GET_LIMIT]
+                )
+            except (ClientError, BotoCoreError):
+                continue  # throttled or transient; poll again next round
+            for execution in response["QueryExecutions"]:
+                state = execution["Status"]["State"]
+                if state in FINAL_STATES:
+                    self._running.pop(execution["QueryExecutionId"]).set_result(execution)
+                    finished += 1
+        return finished
+
+    def _run(self):
+        try:
+            self._loop()
+        except BaseException as e:
+            self._fail_all(e)  # callers see the error through their Futures
+
+    def _fail_all(self, error):
+        """Fail every pending Future so no caller waits on a dead thread."""
+        with self._wakeup:
+            pending = [item[2] for item in self._queued] + list(self._running.values())
+            self._queued.clear()
+            self._running.clear()
+            self._thread = None
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def _loop(self):
+        delay = config.ATHENA_POLL_INITIAL_SECONDS
+        while True:
+            with self._wakeup:
+                if not self._queued and not self._running:
+                    if self._closed:
+                        return
+                    self._wakeup.wait()
+                    delay = config.ATHENA_POLL_INITIAL_SECONDS
+                    continue
+                batch = []
+                while self._queued and len(self._running) + len(batch) < self.max_concurrency:
+                    batch.append(self._queued.popleft())
+
+            throttled = False
+            for i, item in enumerate(batch):
+                if not self._start(*item):
+                    with self._wakeup:
+                        self._queued.extendleft(reversed(batch[i:]))
+                    throttled = True
+                    break
+
+            finished = self._poll() if self._running else 0
+            if finished or (batch and not throttled):
+                delay = config.ATHENA_POLL_INITIAL_SECONDS
+            else:
+                delay = min(delay * BACKOFF_FACTOR, config.ATHENA_POLL_MAX_SECONDS)
+
+            with self._wakeup:
+                if not self._queued or len(self._running) >= self.max_concurrency or throttled:
+                    self._wakeup.wait(delay)
@@ -0,0 +1,156 @@
+
+import io
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import config
+from s3_utils import iter_ranged_get
+
+
+# Athena ColumnInfo "Type" → Arrow type; anything else stays a string
+ATHENA_TYPES = {
+    "boolean": pa.bool_(),
+    "tinyint": pa.int8(),
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "int": pa.int32(),
+    "bigint": pa.int64(),
+    "float": pa.float32(),
+    "real": pa.float32(),
+    "double": pa.float64(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp("ms"),
+}
+
+
+def arrow_type(column):
+    """Arrow type for one ResultSetMetadata ColumnInfo entry."""
+    athena_type = column["Type"].lower()
+    if athena_type == "decimal":
+        return pa.decimal128(column.get("Precision", 38), column.get("Scale", 0))
+    return ATHENA_TYPES.get(athena_type, pa.string())
+
+
+def result_schema(metadata):
+    """Arrow schema from a get_query_results ResultSetMetadata."""
+    return pa.schema([
+        (column["Name"], arrow_type(column)) for column in metadata["ColumnInfo"]
+    ])
+
+
+def rows_to_batch(rows, schema):
+    """Typed RecordBatch from get_query_results rows (VarCharValue strings)."""
+    columns = []
+    for i, field in enumerate(schema):
+        values = pa.array(
+            [row["Data"][i].get("VarCharValue") for row in rows], pa.string()
+        )
+        columns.append(values if field.type == pa.string() else pc.cast(values, field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def iter_result_batches(athena_client, execution_id):
+    """Lazily page through get_query_results, one RecordBatch per page.
+
+    The first row of the first page repeats the column names and is
+    skipped; types come from the result set's column metadata.
+    """
+    paginator = athena_client.get_paginator("get_query_results")
+    pages = paginator.paginate(
+        QueryExecutionId=execution_id,
+        PaginationConfig={"PageSize": config.ATHENA_RESULTS_PAGE_SIZE}
+    )
+    schema = None
+    for page in pages:
+        rows = page["ResultSet"]["Rows"]
+        if schema is None:
+            schema = result_schema(page["ResultSet"]["ResultSetMetadata"])
+            rows = rows[1:]
+        if rows:
+            yield rows_to_batch(rows, schema)
+
+
+class ChunkReader(io.RawIOBase):
+    """Read-only file object over an iterator of bytes chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def result_object(execution):
+    """(bucket, key) of the CSV Athena wrote for a query execution."""
+    location = urlparse(execution["ResultConfiguration"]["OutputLocation"])
+    return location.netloc, location.path.lstrip("/")
+
+
+def iter_csv_batches(athena_client, s3, execution, size=None):
+    """Stream the result CSV from S3 with parallel ranged GETs.
+
+    Only the column metadata is fetched through the Athena API; the rows
+    come straight from the CSV object and are parsed into typed batches.
+    """
+    metadata = athena_client.get_query_results(
+        QueryExecutionId=execution["QueryExecutionId"], MaxResults=1
+    )["ResultSet"]["ResultSetMetadata"]
+    schema = result_schema(metadata)
+
+    _, key = result_object(execution)
+    if size is None:
+        size = s3.head_object(Bucket=config.BUCKET_NAME, Key=key)["ContentLength"]
+    chunks = iter_ranged_get(
+        s3, key, size,
+        part_size=config.ATHENA_RESULTS_RANGE_MB * 1024 * 1024,
+        workers=config.ATHENA_RESULTS_WORKERS
+    )
+    reader = pa_csv.open_csv(
+        io.BufferedReader(ChunkReader(chunks), buffer_size=1024 * 1024),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={field.name: field.type for field in schema},
+            # Athena quotes every value and writes NULL as an empty field
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False
+        )
+    )
+    for batch in reader:
+        yield batch
+
+
+def read_results(athena_client, execution, s3=None):
+    """All rows of a finished query as an Arrow table (.to_pandas() for a DataFrame).
+
+    With an S3 client, results larger than ATHENA_CSV_RESULTS_MB are read
+    from the CSV in athena-results/ instead of 1000-row API pages.
+    """
+    if s3 is not None:
+        bucket, key = result_object(execution)
+        if bucket == config.BUCKET_NAME and key.endswith(".csv"):
+            size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+            if size >= config.ATHENA_CSV_RESULTS_MB * 1024 * 1024:
+                return pa.Table.from_batches(list(
+                    iter_csv_batches(athena_client, s3, execution, size=size)
+                ))
+
+    batches = list(iter_result_batches(athena_client, execution["QueryExecutionId"]))
+    if not batches:
+        metadata = athena_client.get_query_results(
+            QueryExecutionId=execution["QueryExecutionId"], MaxResults=1
+        )["ResultSet"]["ResultSetMetadata"]
+        return result_schema(metadata).empty_table()
+    return pa.Table.from_batches(batches)
@@ -1,13 +1,30 @@
 
 import os
+import re
+import glob
+import json
+import hashlib
+import time
 import subprocess
-import gzip
 import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 import boto3
 from botocore.exceptions import ClientError
 import config
+from compression import (
+    EXTENSIONS, compression_level, compression_stats, describe_codec, get_compressor
+)
+from s3_utils import delete_keys, list_common_prefixes, list_objects
+from retention import apply_gfs_retention
+from chunk_store import (
+    MANIFEST_SUFFIX, chunk_codec, chunk_key, gc_chunks, iter_chunks,
+    list_chunk_keys, refresh_chunk, release_lease, take_lease, upload_chunk,
+    wait_for_gc
+)
 
 
 def check_prerequisites():
@@ -47,6 +64,46 @@ def check_prerequisites():
     return True
 
 
+def pg_dump_command(*extra_args):
+    """Build the pg_dump command line for the configured database."""
+    return [
+        "pg_dump",
+        "-h", config.DB_HOST,
+        "-p", str(config.DB_PORT),
+        "-U", config.DB_USER,
+        "-d", config.DB_NAME,
+        "--no-owner",
+        "--no-privileges",
+        *extra_args
+    ]
+
+
+def pg_env():
+    """Environment for PostgreSQL client tools (password via PGPASSWORD)."""
+    env = os.environ.copy()
+    env["PGPASSWORD"] = config.DB_PASSWORD
+    return env
+
+
+def backup_key(filename, now=None):
+    """Build the date-organized S3 key for a backup file."""
+    now = now or datetime.now()
+    return (
+        f"{config.BACKUP_PREFIX}/"
+        f"{now.year}/{now.month:02d}/{now.day:02d}/"
+        f"{filename}"
+    )
+
+
+def backup_tagging():
+    """S3 object tags applied to every backup upload."""
+    return (
+        f"RetentionDays={config.RETENTION_DAYS}"
+        f"&BackupType=pg_dump"
+        f"&Database={config.DB_NAME}"
+    )
+
+
 def take_backup():
     """Run pg_dump and save to a local file."""
     print("\n[2/5] Taking database backup...")
@@ -58,29 +115,17 @@ def take_backup():
     # File names
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     sql_file = os.path.join(backup_dir, f"backup_{timestamp}.sql")
-    gz_file = sql_file + ".gz"
+    gz_file = sql_file + EXTENSIONS[config.BACKUP_CODEC]
 
     # Run pg_dump
     # This creates a text file with all SQL commands to recreate the database
     print(f"  Running pg_dump on database '{config.DB_NAME}'...")
 
-    env = os.environ.copy()
-    env["PGPASSWORD"] = config.DB_PASSWORD
-
     result = subprocess.run(
-        [
-            "pg_dump",
-            "-h", config.DB_HOST,
-            "-p", str(config.DB_PORT),
-            "-U", config.DB_USER,
-            "-d", config.DB_NAME,
-            "--no-owner",
-            "--no-privileges",
-            "-f", sql_file
-        ],
+        pg_dump_command("-f", sql_file),
         capture_output=True,
         text=True,
-        env=env
+        env=pg_env()
     )
 
     if result.returncode != 0:
@@ -90,15 +135,20 @@ def take_backup():
     sql_size = os.path.getsize(sql_file)
     print(f"  ✓ SQL dump created: {sql_size:,} bytes")
 
-    # Compress with gzip
-    print("  Compressing with gzip...")
-    with open(sql_file, "rb") as f_in:
-        with gzip.open(gz_file, "wb", compresslevel=9) as f_out:
-            shutil.copyfileobj(f_in, f_out)
+    # Compress with the configured codec
+    print(f"  Compressing with {describe_codec()}...")
+    started = time.monotonic()
+    compressor = get_compressor()
+    with open(sql_file, "rb") as f_in, open(gz_file, "wb") as f_out:
+        for chunk in iter(lambda: f_in.read(1024 * 1024), b""):
+            f_out.write(compressor.compress(chunk))
+        f_out.write(compressor.flush())
+    elapsed = time.monotonic() - started
 
     gz_size = os.path.getsize(gz_file)
     ratio = (1 - gz_size / sql_size) * 100 if sql_size > 0 else 0
-    print(f"  Compressed: {gz_size:,} bytes ({ratio:.1f}% reduction)")
+    print(f"  Compressed: {gz_size:,} bytes ({ratio:.1f}% reduction)"
+          f" | {compression_stats(sql_size, gz_size, elapsed)}")
 
     # Remove uncompressed file
     os.remove(sql_file)
@@ -110,16 +160,11 @@ def upload_to_s3(local_file, timestamp):
     """Upload the compressed backup to S3."""
     print("\n[3/5] Uploading to S3...")
 
-    now = datetime.now()
     filename = os.path.basename(local_file)
 
     # Build the S3 key with date-based organization
     # Example: backups/postgres/2025/01/10/backup_20250110_143022.sql.gz
-    s3_key = (
-        f"{config.BACKUP_PREFIX}/"
-        f"{now.year}/{now.month:02d}/{now.day:02d}/"
-        f"{filename}"
-    )
+    s3_key = backup_key(filename)
 
     s3 = boto3.client("s3", region_name=config.REGION)
 
@@ -130,13 +175,7 @@ def upload_to_s3(local_file, timestamp):
         Filename=local_file,
         Bucket=config.BUCKET_NAME,
         Key=s3_key,
-        ExtraArgs={
-            "Tagging": (
-                f"RetentionDays={config.RETENTION_DAYS}"
-                f"&BackupType=pg_dump"
-                f"&Database={config.DB_NAME}"
-            )
-        }
+        ExtraArgs={"Tagging": backup_tagging()}
     )
 
     # Verify upload
@@ -151,45 +190,485 @@ def upload_to_s3(local_file, timestamp):
     return s3_key
 
 
-def apply_retention():
-    """Delete backups older than RETENTION_DAYS."""
-    print(f"\n[4/5] Applying retention policy ({config.RETENTION_DAYS} days)...")
+def stream_backup_to_s3():
+    """Pipe pg_dump through the backup codec into an S3 multipart upload.
+
+    Nothing is written to local disk: pg_dump's stdout is compressed
+    incrementally and each full part is uploaded while the dump keeps
+    running. At most STREAM_UPLOAD_WORKERS + 1 parts are held in memory.
+    A failed part stops the dump right away and the upload is aborted.
+    """
+    print(f"\n[2/5] Streaming backup to S3 (pg_dump → {describe_codec()} → multipart)...")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    s3_key = backup_key(f"backup_{timestamp}.sql{EXTENSIONS[config.BACKUP_CODEC]}")
+    part_size = config.MULTIPART_CHUNK_MB * 1024 * 1024
 
     s3 = boto3.client("s3", region_name=config.REGION)
-    cutoff_date = datetime.now(timezone.utc) - timedelta(days=config.RETENTION_DAYS)
-    print(f"  Cutoff date: {cutoff_date.strftime('%Y-%m-%d')}")
+    print(f"  Running pg_dump on database '{config.DB_NAME}'...")
+    print(f"  Destination: s3://{config.BUCKET_NAME}/{s3_key}")
+
+    upload_id = s3.create_multipart_upload(
+        Bucket=config.BUCKET_NAME,
+        Key=s3_key,
+        Tagging=backup_tagging()
+    )["UploadId"]
+
+    # stderr goes to a temp file so a chatty pg_dump can never block on a full pipe
+    stderr_file = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        pg_dump_command(),
+        stdout=subprocess.PIPE,
+        stderr=stderr_file,
+        env=pg_env()
+    )
+
+    compressor = get_compressor()
+    compress_seconds = 0.0
+    slots = threading.BoundedSemaphore(config.STREAM_UPLOAD_WORKERS)
+    parts = []
+    failures = []
+    buffer = bytearray()
+    sql_size = 0
+    gz_size = 0
+
+    def upload_part(part_number, body):
+        try:
+            response = s3.upload_part(
+                Bucket=config.BUCKET_NAME,
+                Key=s3_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        except Exception as e:
+            failures.append(e)
+            raise
+        finally:
+            slots.release()
+
+    def submit_part(pool, body):
+        slots.acquire()
+        parts.append(pool.submit(upload_part, len(parts) + 1, body))
 
-    # List all backup objects
-    deleted_count = 0
     try:
-        paginator = s3.get_paginator("list_objects_v2")
-        pages = paginator.paginate(
+        with ThreadPoolExecutor(max_workers=config.STREAM_UPLOAD_WORKERS) as pool:
+            while True:
+                # Stop the dump as soon as a part fails instead of streaming the rest
+                if failures:
+                    raise failures[0]
+                chunk = proc.stdout.read(1024 * 1024)
+                if not chunk:
+                    break
+                sql_size += len(chunk)
+                started = time.monotonic()
+                buffer += compressor.compress(chunk)
+                compress_seconds += time.monotonic() - started
+
+                if len(buffer) >= part_size:
+                    gz_size += len(buffer)
+                    submit_part(pool, bytes(buffer))
+                    buffer.clear()
+
+            # The last part may be smaller than the 5 MB minimum
+            started = time.monotonic()
+            buffer += compressor.flush()
+            compress_seconds += time.monotonic() - started
+            gz_size += len(buffer)
+            submit_part(pool, bytes(buffer))
+            buffer.clear()
+
+            completed_parts = [future.result() for future in parts]
+
+        proc.wait()
+        if proc.returncode != 0:
+            stderr_file.seek(0)
+            error = stderr_file.read().decode(errors="replace")
+            raise RuntimeError(f"pg_dump failed: {error.strip()}")
+
+        s3.complete_multipart_upload(
             Bucket=config.BUCKET_NAME,
-            Prefix=f"{config.BACKUP_PREFIX}/"
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": completed_parts}
+        )
+
+    except BaseException as e:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        # Also on Ctrl-C, so no orphaned parts are left to be billed
+        s3.abort_multipart_upload(
+            Bucket=config.BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id
+        )
+        if not isinstance(e, Exception):
+            raise
+        print(f"  ✗ Streaming backup failed: {e}")
+        return None
+
+    finally:
+        proc.stdout.close()
+        stderr_file.close()
+
+    print(f"  ✓ SQL dump streamed: {sql_size:,} bytes")
+    ratio = (1 - gz_size / sql_size) * 100 if sql_size > 0 else 0
+    # pgzip and zstd compress on their own threads while pg_dump streams, so
+    # time spent in compress() is mostly handing data over, not throughput
+    if config.BACKUP_CODEC in ("pgzip", "zstd"):
+        compress_seconds = None
+    print(f"  Compressed: {gz_size:,} bytes ({ratio:.1f}% reduction)"
+          f" | {compression_stats(sql_size, gz_size, compress_seconds)}")
+    print(f"  Uploaded in {len(completed_parts)} part(s)")
+
+    print("\n[3/5] Verifying upload...")
+    try:
+        response = s3.head_object(Bucket=config.BUCKET_NAME, Key=s3_key)
+        size = response["ContentLength"]
+        print(f"  ✓ Upload verified! Size in S3: {size:,} bytes")
+    except ClientError:
+        print("  ✗ Upload verification failed!")
+        return None
+
+    return s3_key
+
+
+def parallel_backup_to_s3():
+    """Run a parallel directory-format pg_dump and upload files as they finish.
+
+    pg_dump -Fd -j N writes one data file per table. With -v it logs
+    "finished item <id>" when a worker has closed <id>.dat.gz, so each file
+    is uploaded (and removed locally) while the other tables are still
+    being dumped. toc.dat is uploaded last: without it pg_restore cannot
+    read the directory, so a half-finished backup is never restorable.
+    """
+    print(f"\n[2/5] Taking parallel backup (pg_dump -Fd -j {config.DUMP_JOBS})...")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_dir = os.path.join(os.path.expanduser("~"), "pg_backups_temp")
+    os.makedirs(backup_dir, exist_ok=True)
+    dump_dir = os.path.join(backup_dir, f"backup_{timestamp}")
+    s3_prefix = backup_key(f"backup_{timestamp}")
+
+    s3 = boto3.client("s3", region_name=config.REGION)
+    print(f"  Running pg_dump on database '{config.DB_NAME}'...")
+    print(f"  Destination: s3://{config.BUCKET_NAME}/{s3_prefix}/")
+
+    # Force untranslated messages so "finished item" can be matched
+    env = pg_env()
+    env["LC_MESSAGES"] = "C"
+    # pg_dump compresses each table file itself; zstd needs PostgreSQL 16+
+    if config.BACKUP_CODEC == "zstd":
+        compress_arg = f"zstd:{compression_level('zstd')}"
+    else:
+        compress_arg = str(compression_level("gzip"))
+
+    proc = subprocess.Popen(
+        pg_dump_command(
+            "-Fd", "-j", str(config.DUMP_JOBS), "-Z", compress_arg,
+            "-v", "-f", dump_dir
+        ),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        env=env
+    )
+
+    finished_item = re.compile(r"finished item (\d+)")
+    uploaded = {}
+    futures = []
+    errors = []
+
+    def upload_file(local_path):
+        key = f"{s3_prefix}/{os.path.basename(local_path)}"
+        size = os.path.getsize(local_path)
+        s3.upload_file(
+            Filename=local_path,
+            Bucket=config.BUCKET_NAME,
+            Key=key,
+            ExtraArgs={"Tagging": backup_tagging()}
         )
+        os.remove(local_path)
+        return key, size
+
+    def submit(pool, local_path):
+        name = os.path.basename(local_path)
+        if name not in uploaded:
+            uploaded[name] = local_path
+            futures.append(pool.submit(upload_file, local_path))
+
+    def submitted_keys():
+        # Every file handed to the pool, including ones whose upload failed
+        # part-way: deleting a key that was never written is a no-op
+        return [f"{s3_prefix}/{name}" for name in uploaded]
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.BACKUP_UPLOAD_WORKERS) as pool:
+            for line in proc.stderr:
+                match = finished_item.search(line)
+                if match:
+                    for path in glob.glob(os.path.join(dump_dir, f"{match.group(1)}.dat*")):
+                        submit(pool, path)
+                elif line.startswith("pg_dump: error:"):
+                    errors.append(line.strip())
+            proc.wait()
+
+            if proc.returncode == 0:
+                # Anything not announced by a worker (blobs, serial -j 1 runs)
+                for path in sorted(glob.glob(os.path.join(dump_dir, "*"))):
+                    if os.path.basename(path) != "toc.dat":
+                        submit(pool, path)
+
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    errors.append(f"upload failed: {e}")
+    except BaseException:
+        # Interrupted: the pool has drained, so every upload has settled
+        proc.kill()
+        proc.wait()
+        delete_keys(s3, submitted_keys())
+        shutil.rmtree(dump_dir, ignore_errors=True)
+        raise
+
+    if proc.returncode != 0 or errors:
+        print(f"  ✗ Parallel backup failed: {'; '.join(errors) or 'pg_dump error'}")
+        # Without toc.dat these files are unusable, so don't leave them behind
+        delete_keys(s3, submitted_keys())
+        shutil.rmtree(dump_dir, ignore_errors=True)
+        return None
+
+    total_size = sum(size for _, size in results)
+    print(f"  ✓ Uploaded {len(results)} data file(s): {total_size:,} bytes")
+
+    # Upload the manifest last: its presence marks the backup complete
+    print("\n[3/5] Uploading manifest (toc.dat)...")
+    toc_key = f"{s3_prefix}/toc.dat"
+    try:
+        _, toc_size = upload_file(os.path.join(dump_dir, "toc.dat"))
+        s3.head_object(Bucket=config.BUCKET_NAME, Key=toc_key)
+        print(f"  ✓ Manifest verified! {toc_size:,} bytes")
+    except Exception as e:
+        print(f"  ✗ Manifest verification failed! {e}")
+        # An incomplete directory backup can't be restored; remove it whole
+        delete_keys(s3, submitted_keys() + [toc_key])
+        return None
+    finally:
+        shutil.rmtree(dump_dir, ignore_errors=True)
+
+    return s3_prefix
+
 
-        for page in pages:
-            if "Contents" not in page:
+def incremental_backup_to_s3():
+    """Upload only the content-defined chunks of pg_dump not already in S3.
+
+    The dump is streamed, split by iter_chunks() and hashed. Chunks whose
+    key is already in the chunk store are skipped; new ones are compressed
+    and uploaded on a bounded thread pool. Reused chunks older than half
+    of CHUNK_GC_GRACE_HOURS are refreshed so a concurrent gc_chunks()
+    can't delete them before the manifest lands. The backup itself is a small
+    manifest listing the chunk hashes in order, stored under the usual
+    date-organized key and written only after every chunk has landed.
+    A backup lease keeps gc_chunks() from deleting while it runs, and a
+    backup that takes longer than half the grace period gives up rather
+    than write a manifest that may point at collected chunks.
+    """
+    print("\n[2/5] Taking incremental backup (content-defined chunks)...")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    manifest_key = backup_key(f"backup_{timestamp}{MANIFEST_SUFFIX}")
+    codec = chunk_codec()
+    grace_half = timedelta(hours=config.CHUNK_GC_GRACE_HOURS / 2)
+
+    s3 = boto3.client("s3", region_name=config.REGION)
+    lease = take_lease(s3, "backup")
+    try:
+        return chunk_backup(s3, manifest_key, codec, grace_half)
+    finally:
+        release_lease(s3, lease)
+
+
+def chunk_backup(s3, manifest_key, codec, grace_half):
+    """incremental_backup_to_s3() minus the lease; returns the manifest key."""
+    wait_for_gc(s3)
+    started = datetime.now(timezone.utc)
+    existing = list_chunk_keys(s3)
+    print(f"  Chunk store: {len(existing):,} existing chunk(s)")
+    print(f"  Running pg_dump on database '{config.DB_NAME}'...")
+
+    stderr_file = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        pg_dump_command(),
+        stdout=subprocess.PIPE,
+        stderr=stderr_file,
+        env=pg_env()
+    )
+
+    slots = threading.BoundedSemaphore(config.BACKUP_UPLOAD_WORKERS * 2)
+    refresh_before = started - grace_half
+    hashes = []
+    futures = []
+    refreshes = []
+    raw_size = 0
+
+    def upload(key, chunk):
+        try:
+            return upload_chunk(s3, key, chunk, codec)
+        finally:
+            slots.release()
+
+    def refresh(key, chunk):
+        try:
+            return refresh_chunk(s3, key, chunk, codec)
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.BACKUP_UPLOAD_WORKERS) as pool:
+            for chunk in iter_chunks(proc.stdout):
+                chunk_hash = hashlib.sha256(chunk).hexdigest()
+                hashes.append(chunk_hash)
+                raw_size += len(chunk)
+
+                key = chunk_key(chunk_hash, codec)
+                modified = existing.get(key)
+                if modified is not None and modified >= refresh_before:
+                    continue
+                existing[key] = datetime.now(timezone.utc)
+                slots.acquire()
+                if modified is None:
+                    futures.append(pool.submit(upload, key, chunk))
+                else:
+                    refreshes.append(pool.submit(refresh, key, chunk))
+
+            uploaded_bytes = sum(future.result() for future in futures + refreshes)
+
+        proc.wait()
+        if proc.returncode != 0:
+            stderr_file.seek(0)
+            error = stderr_file.read().decode(errors="replace")
+            raise RuntimeError(f"pg_dump failed: {error.strip()}")
+
+        # Past this, chunks reused without a refresh may already be collectable
+        elapsed = datetime.now(timezone.utc) - started
+        if elapsed > grace_half:
+            raise RuntimeError(
+                f"backup took {elapsed}, longer than half of "
+                f"CHUNK_GC_GRACE_HOURS; raise it and run again"
+            )
+
+        manifest = {
+            "version": 1,
+            "database": config.DB_NAME,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "codec": codec,
+            "raw_size": raw_size,
+            "chunks": hashes,
+        }
+        s3.put_object(
+            Bucket=config.BUCKET_NAME,
+            Key=manifest_key,
+            Body=json.dumps(manifest).encode(),
+            ContentType="application/json",
+            Tagging=backup_tagging()
+        )
+
+    except Exception as e:
+        # Chunks already uploaded are unreferenced and will be garbage-collected
+        print(f"  ✗ Incremental backup failed: {e}")
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        return None
+
+    finally:
+        proc.stdout.close()
+        stderr_file.close()
+
+    print(f"  ✓ SQL dump streamed: {raw_size:,} bytes in {len(hashes):,} chunk(s)")
+    reused = len(hashes) - len(futures)
+    print(f"  New chunks: {len(futures):,} ({uploaded_bytes:,} bytes uploaded)"
+          f" | reused: {reused:,} ({len(refreshes):,} refreshed for GC)")
+
+    print("\n[3/5] Verifying manifest...")
+    try:
+        response = s3.head_object(Bucket=config.BUCKET_NAME, Key=manifest_key)
+        print(f"  ✓ Manifest verified! Size in S3: {response['ContentLength']:,} bytes")
+    except ClientError:
+        print("  ✗ Manifest verification failed!")
+        return None
+
+    return manifest_key
+
+
+def list_expired_prefixes(s3, cutoff_date):
+    """Return the YYYY/, YYYY/MM/ or YYYY/MM/DD/ prefixes older than the cutoff.
+
+    Only the date levels that straddle the cutoff are listed further, so
+    the number of LIST calls grows with the date tree, not with the number
+    of backups. Non-date folders (like chunks/) are never touched.
+    """
+    cutoff = (cutoff_date.year, cutoff_date.month, cutoff_date.day)
+    expired = []
+
+    def walk(prefix, parts):
+        for child in list_common_prefixes(s3, prefix):
+            name = child[len(prefix):].rstrip("/")
+            if not name.isdigit():
                 continue
+            date_parts = parts + (int(name),)
+            level = len(date_parts)
+            if date_parts < cutoff[:level]:
+                expired.append(child)
+            elif date_parts == cutoff[:level] and level < 3:
+                walk(child, date_parts)
+
+    walk(f"{config.BACKUP_PREFIX}/", ())
+    return expired
 
-            for obj in page["Contents"]:
-                last_modified = obj["LastModified"]
 
-                if last_modified < cutoff_date:
-                    print(f"  Deleting expired: {obj['Key']}")
-                    s3.delete_object(
-                        Bucket=config.BUCKET_NAME,
-                        Key=obj["Key"]
-                    )
-                    deleted_count += 1
+def apply_retention(dry_run=None):
+    """Delete backups in date folders older than RETENTION_DAYS."""
+    if dry_run is None:
+        dry_run = config.RETENTION_DRY_RUN
+    print(f"\n[4/5] Applying retention policy ({config.RETENTION_DAYS} days)...")
+
+    s3 = boto3.client("s3", region_name=config.REGION)
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=config.RETENTION_DAYS)
+    print(f"  Cutoff date: {cutoff_date.strftime('%Y-%m-%d')}")
 
+    # List only the date prefixes that are entirely past the cutoff
+    try:
+        prefixes = list_expired_prefixes(s3, cutoff_date)
+        with ThreadPoolExecutor(max_workers=config.RETENTION_DELETE_WORKERS) as pool:
+            expired = [
+                obj
+                for objects in pool.map(lambda p: list_objects(s3, p), prefixes)
+                for obj in objects
+            ]
     except ClientError as e:
         print(f"  Warning: Could not list objects: {e}")
+        return
+
+    freed = sum(obj["Size"] for obj in expired)
+    for prefix in prefixes:
+        print(f"  Expired: {prefix}")
 
-    if deleted_count == 0:
+    if not expired:
         print("  No expired backups found (all backups are recent)")
+    elif dry_run:
+        print(f"  [dry run] Would delete {len(expired)} object(s), {freed:,} bytes")
     else:
-        print(f"  Deleted {deleted_count} expired backup(s)")
+        deleted_count = delete_keys(
+            s3,
+            [obj["Key"] for obj in expired],
+            workers=config.RETENTION_DELETE_WORKERS
+        )
+        print(f"  Deleted {deleted_count} expired object(s), {freed:,} bytes freed")
 
 
 def cleanup_local(local_file):
@@ -224,6 +703,8 @@ def list_backups():
             return
 
         for obj in response["Contents"]:
+            if obj["Key"].startswith(f"{config.BACKUP_CHUNK_PREFIX}/"):
+                continue
             size = obj.get("Size")
             size_kb = size / 1024
             modified = obj["LastModified"].strftime("%Y-%m-%d %H:%M:%S")
@@ -246,20 +727,53 @@ if __name__ == "__main__":
         print("\n Prerequisites check failed. Fix issues above.")
         exit(1)
 
-    # Step 2: Take backup
-    local_file, timestamp = take_backup()
-    if not local_file:
-        print("\n Backup failed.")
-        exit(1)
-
-    # Step 3: Upload to S3
-    s3_key = upload_to_s3(local_file, timestamp)
-    if not s3_key:
-        print("\n Upload failed.")
-        exit(1)
-
-    # Step 4: Apply retention
-    apply_retention()
+    # Record the source's id high-water marks before pg_dump starts, so
+    # verification can tell a truncated restore from rows added later
+    source_bounds = None
+    if config.VERIFY_BACKUP:
+        # Imported here: verify_backup → restore_from_s3 → backup_to_s3
+        from verify_backup import print_report, source_max_ids, verify_backup
+        source_bounds = source_max_ids()
+
+    if config.BACKUP_MODE in ("stream", "directory", "incremental"):
+        # Steps 2 + 3: Dump and upload in one pass
+        local_file = None
+        if config.BACKUP_MODE == "stream":
+            s3_key = stream_backup_to_s3()
+        elif config.BACKUP_MODE == "directory":
+            s3_key = parallel_backup_to_s3()
+        else:
+            s3_key = incremental_backup_to_s3()
+        if not s3_key:
+            print("\n Backup failed.")
+            exit(1)
+    else:
+        # Step 2: Take backup
+        local_file, timestamp = take_backup()
+        if not local_file:
+            print("\n Backup failed.")
+            exit(1)
+
+        # Step 3: Upload to S3
+        s3_key = upload_to_s3(local_file, timestamp)
+        if not s3_key:
+            print("\n Upload failed.")
+            exit(1)
+
+    # Optional: verify the backup by restoring it, in parallel with steps 4-5
+    verification = None
+    if config.VERIFY_BACKUP:
+        verify_pool = ThreadPoolExecutor(max_workers=1)
+        verification = verify_pool.submit(verify_backup, s3_key, source_bounds)
+        print(f"\n Verifying backup in the background (scratch DB '{config.VERIFY_DB_NAME}')...")
+
+    # Step 4: Apply retention (expired manifests, then unreferenced chunks)
+    if config.RETENTION_POLICY == "gfs":
+        apply_gfs_retention()
+    else:
+        apply_retention()
+    if config.BACKUP_MODE == "incremental":
+        gc_chunks(dry_run=config.RETENTION_DRY_RUN)
 
     # Step 5: Cleanup local
     cleanup_local(local_file)
@@ -267,9 +781,20 @@ if __name__ == "__main__":
     # Show summary
     list_backups()
 
+    if verification:
+        report = verification.result()
+        verify_pool.shutdown()
+        print_report(report)
+        if not report["ok"]:
+            print("\n Backup verification failed.")
+            exit(1)
+
     print()
     print("=" * 55)
     print("  BACKUP COMPLETE!")
     print(f"   s3://{config.BUCKET_NAME}/{s3_key}")
-    print(f"   Retention: {config.RETENTION_DAYS} days")
+    if config.RETENTION_POLICY == "gfs":
+        print(f"   Retention: GFS (plan in {config.RETENTION_PLAN_FILE})")
+    else:
+        print(f"   Retention: {config.RETENTION_DAYS} days")
     print("=" * 55)
\ No newline at end of file
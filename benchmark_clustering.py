@@ -0,0 +1,94 @@
+
+import time
+import shutil
+import argparse
+import tempfile
+
+import pyarrow.parquet as pq
+import config
+from clustering import METHODS
+from generate_data import DATES, SEED, TABLES, partition_rng
+from parquet_writer import PartitionWriter
+
+
+# Predicates shaped like the ones in query_athena.py
+SAMPLE_PREDICATES = {
+    "orders": [("status", "completed"), ("user_id", 3)],
+    "events": [("event_type", "purchase"), ("user_id", 3)],
+}
+
+
+def can_skip(statistics, value):
+    """True if row-group min/max prove `column = value` matches nothing."""
+    if statistics is None or not statistics.has_min_max:
+        return False
+    return value < statistics.min or value > statistics.max
+
+
+def count_skipped(path, column, value):
+    """(row groups skipped, total row groups) for an equality predicate."""
+    metadata = pq.ParquetFile(path).metadata
+    index = metadata.schema.to_arrow_schema().get_field_index(column)
+    skipped = sum(
+        can_skip(metadata.row_group(i).column(index).statistics, value)
+        for i in range(metadata.num_row_groups)
+    )
+    return skipped, metadata.num_row_groups
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure row-group pruning with and without clustering"
+    )
+    parser.add_argument("--table", choices=sorted(TABLES), default="orders")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--row-group-rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    keys = config.CLUSTER_KEYS[args.table]
+    predicates = SAMPLE_PREDICATES[args.table]
+
+    print("=" * 55)
+    print("  Clustering Benchmark")
+    print("=" * 55)
+    print()
+    print(f"{args.table}: {args.rows:,} rows, {args.row_group_rows:,} rows per "
+          f"row group, cluster keys {', '.join(keys)}")
+
+    rng = partition_rng(SEED, args.table, DATES[0])
+    table = TABLES[args.table](DATES[0], args.rows, rng)
+    temp_dir = tempfile.mkdtemp(prefix="cluster_bench_")
+
+    try:
+        for method in ("none", *[m for m in METHODS if m != "none"]):
+            started = time.monotonic()
+            writer = PartitionWriter(
+                f"{temp_dir}/{method}",
+                row_group_rows=args.row_group_rows,
+                cluster_keys=keys,
+                cluster_method=method
+            )
+            writer.write(table)
+            files = writer.close()
+            elapsed = time.monotonic() - started
+
+            print()
+            print(f"[{method}] wrote {sum(f['bytes'] for f in files):,} bytes "
+                  f"in {elapsed:.1f}s")
+            for column, value in predicates:
+                skipped = total = 0
+                for file in files:
+                    s, t = count_skipped(file["path"], column, value)
+                    skipped += s
+                    total += t
+                print(f"  {column} = {value!r}: skipped {skipped}/{total} "
+                      f"row groups ({100 * skipped / total:.0f}%)")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print()
+    print("=" * 55)
+
+
+if __name__ == "__main__":
+    main()
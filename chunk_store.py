@@ -0,0 +1,278 @@
+
+import sys
+import json
+import time
+import uuid
+import zlib
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+import config
+from compression import EXTENSIONS, decompress, get_compressor
+from s3_utils import delete_keys, list_objects
+
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# Leases announce a running gc_chunks() or incremental backup to the other
+LEASE_PREFIX = f"{config.BACKUP_PREFIX}/leases"
+
+
+def chunk_codec():
+    """Codec used for individual chunks (pgzip gains nothing on 1 MB blobs)."""
+    return "zstd" if config.BACKUP_CODEC == "zstd" else "gzip"
+
+
+def chunk_key(chunk_hash, codec):
+    """S3 key of a chunk, fanned out by the first two hex digits."""
+    return (
+        f"{config.BACKUP_CHUNK_PREFIX}/"
+        f"{chunk_hash[:2]}/{chunk_hash}{EXTENSIONS[codec]}"
+    )
+
+
+def iter_chunks(stream, avg_size=None):
+    """Split a pg_dump stream into content-defined chunks.
+
+    Boundaries are picked per line: a line ends a chunk when its CRC falls
+    below len(line) / avg_size of the 32-bit range, so chunks average
+    avg_size bytes and every boundary depends only on the line's content.
+    Inserting or deleting rows therefore changes only the chunks around
+    them; the rest of the dump hashes exactly as in the previous backup.
+    Chunks are kept between avg_size / 4 and avg_size * 4 bytes.
+    """
+    avg_size = avg_size or config.CHUNK_AVG_KB * 1024
+    min_size = avg_size // 4
+    max_size = avg_size * 4
+    scale = (1 << 32) / avg_size
+
+    chunk = bytearray()
+    for line in stream:
+        chunk += line
+        size = len(chunk)
+        if size >= max_size or (
+            size >= min_size and zlib.crc32(line) < len(line) * scale
+        ):
+            yield bytes(chunk)
+            chunk.clear()
+
+    if chunk:
+        yield bytes(chunk)
+
+
+def list_chunk_keys(s3):
+    """Return {key: LastModified} for the chunk store (one paginated listing)."""
+    return {
+        obj["Key"]: obj["LastModified"]
+        for obj in list_objects(s3, f"{config.BACKUP_CHUNK_PREFIX}/")
+    }
+
+
+def upload_chunk(s3, key, chunk, codec):
+    """Compress and store one chunk; returns the compressed size."""
+    compressor = get_compressor(codec)
+    body = compressor.compress(chunk) + compressor.flush()
+    s3.put_object(
+        Bucket=config.BUCKET_NAME,
+        Key=key,
+        Body=body,
+        Tagging="BackupType=chunk"
+    )
+    return len(body)
+
+
+def refresh_chunk(s3, key, chunk, codec):
+    """Bump a reused chunk's LastModified so gc_chunks() leaves it alone.
+
+    The chunk is copied onto itself. If a concurrent GC already deleted
+    it, it is uploaded again. Returns the bytes uploaded (0 if refreshed).
+    """
+    try:
+        s3.copy_object(
+            Bucket=config.BUCKET_NAME,
+            Key=key,
+            CopySource={"Bucket": config.BUCKET_NAME, "Key": key},
+            MetadataDirective="REPLACE",
+            Metadata={"refreshed": datetime.now(timezone.utc).isoformat()}
+        )
+        return 0
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return upload_chunk(s3, key, chunk, codec)
+
+
+def take_lease(s3, kind):
+    """Write a "gc" or "backup" lease object; returns its key."""
+    key = f"{LEASE_PREFIX}/{kind}/{uuid.uuid4().hex}"
+    s3.put_object(Bucket=config.BUCKET_NAME, Key=key, Body=b"")
+    return key
+
+
+def release_lease(s3, key):
+    s3.delete_object(Bucket=config.BUCKET_NAME, Key=key)
+
+
+def active_leases(s3, kind):
+    """Keys of kind leases younger than half of CHUNK_GC_GRACE_HOURS.
+
+    Older leases belong to a crashed run: a backup gives up before its
+    manifest once it has run that long.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        hours=config.CHUNK_GC_GRACE_HOURS / 2
+    )
+    return [
+        obj["Key"] for obj in list_objects(s3, f"{LEASE_PREFIX}/{kind}/")
+        if obj["LastModified"] >= cutoff
+    ]
+
+
+def wait_for_gc(s3, poll_seconds=5):
+    """Block while a gc_chunks() run holds a lease.
+
+    Called after taking a backup lease: a GC that started before it may
+    not have seen the lease, so its deletes must finish before the chunk
+    store is listed.
+    """
+    if active_leases(s3, "gc"):
+        print("  Waiting for a running chunk GC to finish...")
+        while active_leases(s3, "gc"):
+            time.sleep(poll_seconds)
+
+
+def load_manifest(s3, manifest_key):
+    """Download and parse a backup manifest."""
+    response = s3.get_object(Bucket=config.BUCKET_NAME, Key=manifest_key)
+    return json.loads(response["Body"].read())
+
+
+def iter_manifest_data(s3, manifest, workers=8):
+    """Yield the original dump bytes of a manifest, chunk by chunk, in order.
+
+    Chunks are fetched in parallel with a bounded read-ahead window.
+    """
+    codec = manifest["codec"]
+
+    def fetch(chunk_hash):
+        response = s3.get_object(
+            Bucket=config.BUCKET_NAME,
+            Key=chunk_key(chunk_hash, codec)
+        )
+        data = decompress(response["Body"].read(), codec)
+        if hashlib.sha256(data).hexdigest() != chunk_hash:
+            raise ValueError(f"Chunk {chunk_hash} is corrupt")
+        return data
+
+    hashes = manifest["chunks"]
+    window = workers * 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(fetch, h) for h in hashes[:window]]
+        for i in range(len(hashes)):
+            data = pending[i].result()
+            pending[i] = None
+            if i + window < len(hashes):
+                pending.append(pool.submit(fetch, hashes[i + window]))
+            yield data
+
+
+def restore_from_manifest(manifest_key, output_path):
+    """Rebuild the plain SQL dump described by a manifest into a local file."""
+    s3 = boto3.client("s3", region_name=config.REGION)
+    manifest = load_manifest(s3, manifest_key)
+
+    written = 0
+    with open(output_path, "wb") as f_out:
+        for data in iter_manifest_data(s3, manifest):
+            f_out.write(data)
+            written += len(data)
+
+    if written != manifest["raw_size"]:
+        raise ValueError(
+            f"Restored {written:,} bytes, manifest expects {manifest['raw_size']:,}"
+        )
+    return written
+
+
+def gc_chunks(dry_run=False):
+    """Delete chunks no longer referenced by any manifest.
+
+    Reference counts are built from every manifest still under
+    BACKUP_PREFIX, so expiring a backup only means deleting its manifest.
+    Unreferenced chunks younger than CHUNK_GC_GRACE_HOURS are kept because
+    an in-flight backup uploads chunks before its manifest; it refreshes
+    the old chunks it reuses (refresh_chunk()) for the same reason, and
+    the store is listed again right before deleting so a chunk refreshed
+    meanwhile is spared. Nothing is deleted while an incremental backup
+    holds a lease; one that starts later waits for this run's gc lease.
+    """
+    print("  Garbage-collecting unreferenced chunks...")
+
+    s3 = boto3.client("s3", region_name=config.REGION)
+    lease = None if dry_run else take_lease(s3, "gc")
+    try:
+        return collect_garbage(s3, dry_run)
+    finally:
+        if lease:
+            release_lease(s3, lease)
+
+
+def collect_garbage(s3, dry_run):
+    """gc_chunks() minus the lease: find and delete unreferenced chunks."""
+    grace_cutoff = datetime.now(timezone.utc) - timedelta(
+        hours=config.CHUNK_GC_GRACE_HOURS
+    )
+
+    manifest_keys = []
+    chunks = {}
+    for obj in list_objects(s3, f"{config.BACKUP_PREFIX}/"):
+        if obj["Key"].startswith(f"{config.BACKUP_CHUNK_PREFIX}/"):
+            chunks[obj["Key"]] = obj
+        elif obj["Key"].endswith(MANIFEST_SUFFIX):
+            manifest_keys.append(obj["Key"])
+
+    refcounts = Counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for manifest in pool.map(lambda k: load_manifest(s3, k), manifest_keys):
+            refcounts.update(
+                chunk_key(h, manifest["codec"]) for h in manifest["chunks"]
+            )
+
+    garbage = [
+        obj for key, obj in chunks.items()
+        if refcounts[key] == 0 and obj["LastModified"] < grace_cutoff
+    ]
+    if garbage:
+        current = list_chunk_keys(s3)
+        garbage = [obj for obj in garbage if current.get(obj["Key"]) == obj["LastModified"]]
+    freed = sum(obj["Size"] for obj in garbage)
+    print(f"  {len(manifest_keys)} manifest(s) reference "
+          f"{len(refcounts)} of {len(chunks)} chunk(s)")
+
+    if dry_run:
+        print(f"  [dry run] Would delete {len(garbage)} chunk(s), {freed:,} bytes")
+        return len(garbage)
+
+    # Checked after the gc lease was written: a backup that isn't seen here
+    # sees that lease and waits for these deletes before listing the store
+    if garbage and active_leases(s3, "backup"):
+        print("  ✗ Incremental backup in progress, not deleting any chunks")
+        return 0
+
+    delete_keys(s3, [obj["Key"] for obj in garbage])
+
+    print(f"  Deleted {len(garbage)} unreferenced chunk(s), {freed:,} bytes freed")
+    return len(garbage)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python3 chunk_store.py <manifest_key> <output.sql>")
+        exit(1)
+
+    size = restore_from_manifest(sys.argv[1], sys.argv[2])
+    print(f"Rebuilt {sys.argv[2]}: {size:,} bytes")
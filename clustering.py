@@ -0,0 +1,138 @@
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import config
+
+
+METHODS = ("sort", "zorder", "none")
+
+
+def decoded(column):
+    """Dictionary-encoded columns as plain values; Arrow can't sort them."""
+    if pa.types.is_dictionary(column.type):
+        return column.cast(column.type.value_type)
+    return column
+
+
+def sort_table(table, keys):
+    """Table.sort_by() on keys, including dictionary-encoded ones."""
+    if not any(pa.types.is_dictionary(table.column(key).type) for key in keys):
+        return table.sort_by([(key, "ascending") for key in keys])
+    sortable = pa.table({key: decoded(table.column(key)) for key in keys})
+    return table.take(
+        pc.sort_indices(sortable, sort_keys=[(key, "ascending") for key in keys])
+    )
+
+
+def key_ranks(column):
+    """Dense 0-based rank of each value, so any column type becomes an int."""
+    ranks = pc.rank(decoded(column), sort_keys="ascending", tiebreaker="dense")
+    return ranks.to_numpy().astype(np.uint64) - 1
+
+
+def zorder_values(table, keys):
+    """Morton (Z-order) code per row, interleaving the bits of each key's rank.
+
+    Each key gets 64 // len(keys) bits; keys with more distinct values
+    than that are scaled down, which only makes the order coarser.
+    """
+    bits = 64 // len(keys)
+    z = np.zeros(len(table), dtype=np.uint64)
+
+    for position, key in enumerate(keys):
+        ranks = key_ranks(table.column(key))
+        top = int(ranks.max()) if len(ranks) else 0
+        if top >= 1 << bits:
+            ranks = (ranks.astype(np.float64) * ((1 << bits) - 1) / top).astype(np.uint64)
+        for bit in range(bits):
+            z |= ((ranks >> np.uint64(bit)) & np.uint64(1)) << np.uint64(
+                bit * len(keys) + position
+            )
+    return z
+
+
+def cluster_table(table, keys, method=None):
+    """Reorder rows so similar key values end up in the same row groups.
+
+    "sort" orders lexicographically by keys (best for the first key),
+    "zorder" interleaves all keys so every one of them prunes reasonably.
+    """
+    method = method or config.CLUSTER_METHOD
+    if method not in METHODS:
+        raise ValueError(f"Unknown cluster method: {method!r}")
+    if method == "none" or not keys or len(table) < 2:
+        return table
+
+    if method == "sort" or len(keys) == 1:
+        return sort_table(table, keys)
+
+    order = np.argsort(zorder_values(table, keys), kind="stable")
+    return table.take(pa.array(order))
+
+
+def sort_key(table, keys, row):
+    """Comparable tuple of one row's keys, nulls last like Table.sort_by()."""
+    values = [table.column(key)[row].as_py() for key in keys]
+    return tuple((value is None, value) for value in values)
+
+
+def at_or_before(table, keys, cutoff):
+    """Boolean mask of rows whose keys sort at or before the cutoff row.
+
+    cutoff is a sort_key() tuple. Nulls sort last, so every row is at or
+    before a null cutoff value, and only null rows equal it.
+    """
+    def compare(position):
+        values = decoded(table.column(keys[position]))
+        is_null, value = cutoff[position]
+        if is_null:
+            return pc.is_valid(values), pc.is_null(values)
+        value = pa.scalar(value, type=values.type)
+        return (
+            pc.fill_null(pc.less(values, value), False),
+            pc.fill_null(pc.equal(values, value), False),
+        )
+
+    less, equal = compare(len(keys) - 1)
+    mask = pc.or_(less, equal)
+    for position in range(len(keys) - 2, -1, -1):
+        less, equal = compare(position)
+        mask = pc.or_(less, pc.and_(equal, mask))
+    return mask
+
+
+def merge_sorted_runs(runs, keys):
+    """K-way merge of sorted runs; yields tables in overall key order.
+
+    Each run is an iterator of Tables already sorted by keys. Every round
+    takes the run whose current batch ends lowest, emits that batch plus
+    the rows of the other runs' batches that sort before its end, and
+    sorts just those, so memory stays at one batch per run.
+    """
+    runs = [iter(run) for run in runs]
+    current = [next(run, None) for run in runs]
+    while True:
+        active = [i for i, batch in enumerate(current) if batch is not None]
+        if not active:
+            return
+        lowest = min(active, key=lambda i: sort_key(current[i], keys, len(current[i]) - 1))
+        cutoff = sort_key(current[lowest], keys, len(current[lowest]) - 1)
+
+        parts = []
+        for i in active:
+            batch = current[i]
+            if i != lowest:
+                mask = at_or_before(batch, keys, cutoff)
+                parts.append(batch.filter(mask))
+                rest = batch.filter(pc.invert(mask))
+                if len(rest):
+                    current[i] = rest
+                    continue
+            else:
+                parts.append(batch)
+            current[i] = next(runs[i], None)
+
+        merged = pa.concat_tables(parts)
+        if len(merged):
+            yield sort_table(merged, keys)
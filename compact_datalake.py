@@ -0,0 +1,315 @@
+
+import os
+import glob
+import shutil
+import argparse
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pyarrow.parquet as pq
+import config
+from parquet_writer import PartitionWriter
+from partitions import parse_partition, partition_of
+from s3_utils import delete_keys, list_objects
+from upload_datalake import (
+    STAGING_DIR, file_md5, load_upload_manifest, s3_upload_client,
+    save_upload_manifest, scan_files, transfer_config
+)
+
+
+OUTPUT_DIR = "output"
+
+
+def find_small_file_partitions(paths, tables, min_files):
+    """Group lake-relative file paths by partition; keep the crowded ones."""
+    partitions = defaultdict(list)
+    for path in paths:
+        partition = partition_of(path)
+        if (partition and path.endswith(".parquet")
+                and parse_partition(partition)["table"] in tables):
+            partitions[partition].append(path)
+    return {p: sorted(files) for p, files in partitions.items() if len(files) > min_files}
+
+
+def merge_into(writer, readers):
+    """Stream Parquet sources batch by batch into a PartitionWriter.
+
+    The writer clusters the rows by the table's CLUSTER_KEYS in bounded
+    runs (see PartitionWriter), so memory stays at CLUSTER_RUN_ROWS no
+    matter how large the partition is.
+    """
+    for reader in readers:
+        for batch in reader.iter_batches():
+            writer.write(batch)
+
+
+def partition_writer(directory, table_name, run_id):
+    """PartitionWriter for compacted files, clustered like the generator's."""
+    return PartitionWriter(
+        directory, prefix=f"compacted-{run_id}",
+        cluster_keys=config.CLUSTER_KEYS.get(table_name)
+    )
+
+
+def compact_local_partition(partition, paths, run_id):
+    """Compact one partition of the local output/ tree.
+
+    New files are written to a hidden .compacting/ folder, renamed into
+    the partition (an atomic rename per file) and only then are the
+    originals removed.
+    """
+    directory = os.path.join(OUTPUT_DIR, *partition.split("/"))
+    staging = os.path.join(directory, ".compacting")
+    originals = [os.path.join(OUTPUT_DIR, *path.split("/")) for path in paths]
+    table_name = parse_partition(partition)["table"]
+
+    writer = partition_writer(staging, table_name, run_id)
+    merge_into(writer, [pq.ParquetFile(path) for path in originals])
+    new_files = writer.close()
+
+    for file in new_files:
+        final_path = os.path.join(directory, os.path.basename(file["path"]))
+        os.replace(file["path"], final_path)
+        file["path"] = final_path
+    for path in originals:
+        os.remove(path)
+    os.rmdir(staging)
+
+    return new_files
+
+
+def has_local_table(partition):
+    """True if output/ has the partition's table at all."""
+    table_name = parse_partition(partition)["table"]
+    return os.path.isdir(os.path.join(OUTPUT_DIR, table_name))
+
+
+def local_copy_matches(partition, paths):
+    """True if output/ holds exactly these originals, or lacks the table.
+
+    Checked before an S3 partition is compacted: a differing local copy
+    couldn't be mirrored, and upload_datalake.py --sync would then
+    re-upload or delete files in the compacted partition.
+    """
+    if not has_local_table(partition):
+        return True
+    directory = os.path.join(OUTPUT_DIR, *partition.split("/"))
+    originals = {os.path.join(OUTPUT_DIR, *path.split("/")) for path in paths}
+    return set(glob.glob(os.path.join(directory, "*.parquet"))) == originals
+
+
+def mirror_local_partition(partition, paths, new_files):
+    """Swap S3-compacted files into output/ if it holds the same originals.
+
+    Otherwise the next upload_datalake.py --sync would upload the local
+    originals again next to the compacted file. Returns True if mirrored.
+    """
+    if not has_local_table(partition) or not local_copy_matches(partition, paths):
+        return False
+
+    directory = os.path.join(OUTPUT_DIR, *partition.split("/"))
+    originals = {os.path.join(OUTPUT_DIR, *path.split("/")) for path in paths}
+    for file in new_files:
+        final_path = os.path.join(directory, os.path.basename(file["local_path"]))
+        shutil.move(file["local_path"], final_path)
+        file["local_path"] = final_path
+    for path in originals:
+        os.remove(path)
+    return True
+
+
+def compact_s3_partition(s3, partition, paths, run_id):
+    """Compact one partition in S3.
+
+    Originals are downloaded to a local temp directory in parallel,
+    streamed into the merged files and uploaded under a _staging/ prefix
+    outside every table location. Each new file is then copied into the
+    partition server-side and the originals are deleted in a single
+    DeleteObjects call, keeping the window in which Athena could see both
+    sets as short as possible. If output/ holds the same originals, the
+    compacted files replace them there too (see mirror_local_partition);
+    main() skips partitions whose local copy differs before calling this.
+    """
+    prefix = config.DATALAKE_PREFIX
+    table_name = parse_partition(partition)["table"]
+    temp_dir = tempfile.mkdtemp(prefix="compact_")
+    download_dir = os.path.join(temp_dir, "originals")
+    os.makedirs(download_dir)
+
+    def fetch(path):
+        local_path = os.path.join(download_dir, os.path.basename(path))
+        s3.download_file(
+            Bucket=config.BUCKET_NAME,
+            Key=f"{prefix}/{path}",
+            Filename=local_path,
+            Config=transfer_config()
+        )
+        return pq.ParquetFile(local_path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            readers = list(pool.map(fetch, paths))
+
+        writer = partition_writer(os.path.join(temp_dir, "compacted"), table_name, run_id)
+        merge_into(writer, readers)
+        new_files = writer.close()
+
+        staged = []
+        for file in new_files:
+            name = os.path.basename(file["path"])
+            staging_key = f"{prefix}/{STAGING_DIR}/{partition}/{name}"
+            s3.upload_file(
+                Filename=file["path"],
+                Bucket=config.BUCKET_NAME,
+                Key=staging_key,
+                Config=transfer_config()
+            )
+            staged.append((staging_key, f"{prefix}/{partition}/{name}"))
+            file["local_path"] = file["path"]
+            file["relative_path"] = f"{partition}/{name}"
+            file["path"] = f"s3://{config.BUCKET_NAME}/{prefix}/{partition}/{name}"
+
+        for file, (staging_key, final_key) in zip(new_files, staged):
+            response = s3.copy_object(
+                Bucket=config.BUCKET_NAME,
+                Key=final_key,
+                CopySource={"Bucket": config.BUCKET_NAME, "Key": staging_key}
+            )
+            file["etag"] = response["CopyObjectResult"]["ETag"].strip('"')
+        delete_keys(s3, [f"{prefix}/{path}" for path in paths])
+        delete_keys(s3, [staging_key for staging_key, _ in staged])
+
+        mirrored = mirror_local_partition(partition, paths, new_files)
+        for file in new_files:
+            if not mirrored:
+                file["local_path"] = None
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return new_files
+
+
+def update_upload_manifest(results):
+    """Bring UPLOAD_MANIFEST_FILE in line with S3-compacted partitions.
+
+    Originals are dropped; compacted files mirrored into output/ are
+    recorded with the ETag S3 holds, so --sync sees them as unchanged.
+    Returns the partitions whose local copy differs from what was
+    compacted and was left alone.
+    """
+    manifest = load_upload_manifest()
+    unmirrored = []
+    for partition, before, after in results:
+        for path in before:
+            manifest.pop(path, None)
+        for file in after:
+            if file["local_path"] is None:
+                continue
+            stat = os.stat(file["local_path"])
+            manifest[file["relative_path"]] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "md5": file_md5(file["local_path"]),
+                "etag": file["etag"],
+            }
+        if after and after[0]["local_path"] is None:
+            unmirrored.append(partition)
+    save_upload_manifest(manifest)
+    return unmirrored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact small Parquet files")
+    parser.add_argument(
+        "--s3", action="store_true",
+        help="compact the data lake in S3 instead of the local output/ tree"
+    )
+    parser.add_argument(
+        "--tables", nargs="+", default=["orders", "events"],
+        help="tables to compact (default: orders events)"
+    )
+    parser.add_argument(
+        "--min-files", type=int, default=config.COMPACTION_MIN_FILES,
+        help="compact partitions with more than this many files"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=config.COMPACTION_WORKERS,
+        help="partitions compacted in parallel"
+    )
+    args = parser.parse_args()
+
+    print("=" * 55)
+    print("  Compacting Data Lake Partitions")
+    print("=" * 55)
+    print()
+
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    if args.s3:
+        s3 = s3_upload_client()
+        prefix = config.DATALAKE_PREFIX
+        paths = [
+            obj["Key"][len(prefix) + 1:]
+            for obj in list_objects(s3, f"{prefix}/")
+        ]
+        location = f"s3://{config.BUCKET_NAME}/{prefix}/"
+    else:
+        if not os.path.exists(OUTPUT_DIR):
+            print(f"'{OUTPUT_DIR}/' directory not found!")
+            exit(1)
+        paths = [relative_path for _, relative_path, _ in scan_files(OUTPUT_DIR)]
+        location = f"{OUTPUT_DIR}/"
+
+    partitions = find_small_file_partitions(paths, set(args.tables), args.min_files)
+    print(f"{location}: {len(partitions)} partition(s) with more than "
+          f"{args.min_files} files")
+    if args.s3:
+        # Nothing in S3 is touched for these: the local copy couldn't follow
+        for partition in sorted(partitions):
+            if not local_copy_matches(partition, partitions[partition]):
+                print(f"  ✗ {partition}: {OUTPUT_DIR}/ copy differs from S3, skipped "
+                      f"(regenerate and --sync it first)")
+                del partitions[partition]
+    print()
+
+    def compact(item):
+        partition, files = item
+        if args.s3:
+            return partition, files, compact_s3_partition(s3, partition, files, run_id)
+        return partition, files, compact_local_partition(partition, files, run_id)
+
+    total_before = 0
+    total_after = 0
+    results = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for partition, before, after in pool.map(compact, sorted(partitions.items())):
+            rows = sum(file["rows"] for file in after)
+            size = sum(file["bytes"] for file in after)
+            print(f"  {partition}: {len(before)} files → {len(after)} "
+                  f"({rows:,} rows, {size:,} bytes)")
+            total_before += len(before)
+            total_after += len(after)
+            results.append((partition, before, after))
+
+    if args.s3 and results:
+        unmirrored = update_upload_manifest(results)
+        print()
+        print(f"  ✓ {config.UPLOAD_MANIFEST_FILE} updated for "
+              f"{len(results) - len(unmirrored)} partition(s) mirrored into {OUTPUT_DIR}/")
+        for partition in unmirrored:
+            if not has_local_table(partition):
+                continue  # S3-only table, --sync leaves it alone
+            print(f"  ✗ {OUTPUT_DIR}/{partition} does not hold the compacted originals; "
+                  f"upload_datalake.py --sync would re-upload or delete files there")
+
+    print()
+    print("=" * 55)
+    print(f"  Compacted {len(partitions)} partition(s): "
+          f"{total_before} files → {total_after}")
+    print("=" * 55)
+
+
+if __name__ == "__main__":
+    main()
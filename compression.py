@@ -0,0 +1,202 @@
+
+import os
+import gzip
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+# File extension written for each codec
+EXTENSIONS = {
+    "gzip": ".gz",
+    "pgzip": ".gz",
+    "zstd": ".zst",
+}
+
+
+class GzipCompressor:
+    """Single-threaded gzip with a tunable level."""
+
+    def __init__(self, level):
+        # wbits=31 → standard gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class ParallelGzipCompressor:
+    """Block-parallel gzip across all cores (pigz-style).
+
+    Input is cut into fixed-size blocks and every block is compressed as an
+    independent gzip member on a thread pool (zlib releases the GIL). The
+    members are emitted in order; concatenated gzip members are a valid .gz
+    that gunzip, zcat and Python's gzip module read as one stream.
+    """
+
+    def __init__(self, level, threads, block_size=4 * 1024 * 1024):
+        self._level = level
+        self._block_size = block_size
+        self._threads = threads
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+
+    def _compress_block(self, block):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+        return compressor.compress(block) + compressor.flush()
+
+    def _drain(self, limit):
+        # Return finished blocks in order, waiting once too many are in flight
+        output = bytearray()
+        while self._pending and (
+            len(self._pending) > limit or self._pending[0].done()
+        ):
+            output += self._pending.popleft().result()
+        return bytes(output)
+
+    def compress(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._pending.append(self._pool.submit(self._compress_block, block))
+        return self._drain(limit=self._threads * 2)
+
+    def flush(self):
+        if self._buffer or not self._pending:
+            self._pending.append(
+                self._pool.submit(self._compress_block, bytes(self._buffer))
+            )
+            self._buffer.clear()
+        output = self._drain(limit=0)
+        self._pool.shutdown()
+        return output
+
+
+class ZstdCompressor:
+    """Multi-threaded zstd with long-range matching (needs `zstandard`)."""
+
+    def __init__(self, level, threads):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                "BACKUP_CODEC = 'zstd' needs the zstandard package "
+                "(pip install zstandard)"
+            )
+
+        params = zstandard.ZstdCompressionParameters.from_level(
+            level,
+            threads=threads,
+            enable_ldm=True,
+            window_log=27
+        )
+        self._compressor = zstandard.ZstdCompressor(
+            compression_params=params
+        ).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class GzipDecompressor:
+    """Streaming gzip decompressor that also reads multi-member (pgzip) files."""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(31)
+
+    def decompress(self, data):
+        output = []
+        while data:
+            output.append(self._decompressor.decompress(data))
+            if self._decompressor.eof:
+                # Next gzip member starts right after this one
+                data = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(31)
+            else:
+                data = b""
+        return b"".join(output)
+
+
+def compression_level(codec=None):
+    """BACKUP_COMPRESSION_LEVEL if set, else the codec's own default level."""
+    if config.BACKUP_COMPRESSION_LEVEL is not None:
+        return config.BACKUP_COMPRESSION_LEVEL
+    return config.BACKUP_COMPRESSION_LEVELS.get(codec or config.BACKUP_CODEC)
+
+
+def get_compressor(codec=None, level=None):
+    """Create a streaming compressor for the configured (or given) codec."""
+    codec = codec or config.BACKUP_CODEC
+    level = level if level is not None else compression_level(codec)
+    threads = config.COMPRESSION_THREADS or os.cpu_count() or 1
+
+    if codec == "gzip":
+        return GzipCompressor(level)
+    elif codec == "pgzip":
+        return ParallelGzipCompressor(level, threads)
+    elif codec == "zstd":
+        return ZstdCompressor(level, threads)
+
+    raise ValueError(f"Unknown BACKUP_CODEC: {codec!r}")
+
+
+def decompress(data, codec):
+    """Decompress a complete blob written by get_compressor(codec)."""
+    if codec in ("gzip", "pgzip"):
+        # gzip.decompress reads every member of a multi-member .gz
+        return gzip.decompress(data)
+    elif codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    raise ValueError(f"Unknown codec: {codec!r}")
+
+
+def get_decompressor(codec):
+    """Create a streaming decompressor with a decompress(data) method."""
+    if codec in ("gzip", "pgzip"):
+        return GzipDecompressor()
+    elif codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    raise ValueError(f"Unknown codec: {codec!r}")
+
+
+def codec_for_key(key):
+    """Guess the codec of a backup object from its file extension."""
+    if key.endswith(".zst"):
+        return "zstd"
+    elif key.endswith(".gz"):
+        return "gzip"
+    return None
+
+
+def describe_codec(codec=None, level=None):
+    """Short label like 'zstd-3' for log lines."""
+    codec = codec or config.BACKUP_CODEC
+    level = level if level is not None else compression_level(codec)
+    return f"{codec}-{level}"
+
+
+def compression_stats(raw_size, compressed_size, seconds):
+    """Format ratio and throughput next to the '% reduction' line.
+
+    Pass seconds=None when compression time wasn't measured; throughput
+    is then left out.
+    """
+    ratio = raw_size / compressed_size if compressed_size else 0
+    if seconds is None:
+        return f"ratio {ratio:.2f}x, {describe_codec()}"
+    mb_per_sec = raw_size / (1024 * 1024) / seconds if seconds > 0 else 0
+    return f"ratio {ratio:.2f}x, {mb_per_sec:.1f} MB/s, {describe_codec()}"
@@ -14,8 +14,151 @@ DB_NAME = "saas_platform"
 BACKUP_PREFIX = "backups/postgres"
 DATALAKE_PREFIX = "datalake"
 
+# Parquet writer (parquet_writer.py): Athena scans best with 128-512 MB files
+PARQUET_TARGET_FILE_MB = 256         # roll to the next part-NNNNN.parquet here
+PARQUET_ROW_GROUP_ROWS = 1_000_000   # rows per row group
+PARQUET_CODEC = "snappy"             # "snappy" or "zstd"
+PARQUET_COMPRESSION_LEVEL = None     # e.g. 3 for zstd; None = codec default
+PARQUET_DICTIONARY_COLUMNS = ["currency", "status", "event_type", "user_email", "device"]
+PARQUET_WRITE_STATISTICS = True      # min/max stats for row-group pruning
+
+# Clustering (clustering.py): row order inside each partition, so Parquet
+# min/max statistics can skip row groups. Method: "sort", "zorder" or "none"
+CLUSTER_METHOD = "sort"
+CLUSTER_KEYS = {
+    "orders": ["status", "user_id"],
+    "events": ["event_type", "user_id"],
+}
+# Rows clustered in memory at once; bigger partitions are sorted in runs of
+# this size, spilled to disk and merged, so memory stays bounded
+CLUSTER_RUN_ROWS = 4_000_000
+
+# Compaction (compact_datalake.py): merge partitions with many small files
+COMPACTION_MIN_FILES = 8             # compact partitions with more files than this
+COMPACTION_WORKERS = 4               # partitions compacted in parallel
+
+# Rollups (rollups.py): daily/monthly aggregates rebuilt for touched partitions
+ROLLUP_WORKERS = 4                   # rollup partitions built in parallel
+QUERY_USE_ROLLUPS = False            # answer query_athena.py aggregates from rollups
+
+# Data lake upload engine (upload_datalake.py)
+DATALAKE_UPLOAD_WORKERS = 16             # files uploaded concurrently
+DATALAKE_MULTIPART_THRESHOLD_MB = 64     # files above this use multipart
+DATALAKE_MULTIPART_CHUNK_MB = 16         # multipart part size
+DATALAKE_MULTIPART_CONCURRENCY = 4       # parts in flight per large file
+PROGRESS_INTERVAL_SECONDS = 2            # aggregate MB/s + files/s report
+
+# Incremental sync: only upload new/changed files (upload_datalake.py --sync)
+DATALAKE_SYNC = False
+UPLOAD_MANIFEST_FILE = ".upload_manifest.json"
+
+# Partitions written/uploaded by the last run, for incremental Athena steps
+TOUCHED_PARTITIONS_FILE = "touched_partitions.json"
+
 # Athena settings
 ATHENA_DATABASE = "saas_datalake"
+ATHENA_PARTITION_PROJECTION = False  # compute partitions from year/month/day
+ATHENA_PROJECTION_YEARS = (2020, 2030)  # year range covered by projection
+ATHENA_PARTITION_BATCH = 100         # partitions per ALTER TABLE ADD PARTITION
+ATHENA_MAX_CONCURRENCY = 20          # queries in flight (account DDL limit)
+ATHENA_POLL_INITIAL_SECONDS = 0.1    # first status poll; backs off x1.5 ...
+ATHENA_POLL_MAX_SECONDS = 2          # ... up to this interval
+ATHENA_RESULTS_PAGE_SIZE = 1000      # rows per get_query_results page (API max)
+ATHENA_CSV_RESULTS_MB = 8            # larger results are read from the CSV in S3
+ATHENA_RESULTS_RANGE_MB = 8          # ranged GET size for the CSV download
+ATHENA_RESULTS_WORKERS = 8           # parallel ranged GETs
+ATHENA_DISPLAY_ROWS = 100            # rows printed per query by query_athena.py
+QUERY_BACKEND = "athena"             # "athena", or "local" (DuckDB over output/)
+QUERY_BYTE_BUDGET_MB = 1024          # refuse bigger scans unless overridden
+
+# Materialized results (materialize.py): UNLOAD heavy queries to Parquet
+QUERY_MATERIALIZE = False            # run report queries as UNLOAD ... PARQUET
+DERIVED_PREFIX = "derived"           # s3://<bucket>/derived/<query hash>/
+MATERIALIZED_REGISTRY_FILE = ".materialized.json"
+MATERIALIZE_READ_WORKERS = 8         # Parquet parts downloaded in parallel
+
+# Query result cache (query_cache.py): keyed by SQL + partition snapshot
+QUERY_CACHE = True
+QUERY_CACHE_DIR = ".query_cache"
+QUERY_CACHE_MAX_MB = 512             # least recently used entries evicted above this
+QUERY_CACHE_TTL_SECONDS = None       # e.g. 3600; None = valid until the data changes
 
 # Retention
-RETENTION_DAYS = 30
\ No newline at end of file
+RETENTION_DAYS = 30
+
+# Retention policy:
+#   "days" - delete everything older than RETENTION_DAYS
+#   "gfs"  - grandfather-father-son: keep all recent backups, then one per
+#            day / week / month for the windows below
+RETENTION_POLICY = "days"
+GFS_KEEP_ALL_HOURS = 48
+GFS_DAILY_DAYS = 30
+GFS_WEEKLY_WEEKS = 26
+GFS_MONTHLY_MONTHS = 36
+
+# Where the GFS keep/delete plan is written (JSON)
+RETENTION_PLAN_FILE = "retention_plan.json"
+
+# Report what retention would delete (and bytes freed) without deleting
+RETENTION_DRY_RUN = False
+
+# Parallel DeleteObjects batches (1000 keys each) during retention
+RETENTION_DELETE_WORKERS = 8
+
+# Backup mode:
+#   "file"        - dump to ~/pg_backups_temp, gzip it, then upload the .gz
+#   "stream"      - pipe pg_dump through gzip straight into an S3 multipart upload
+#   "directory"   - parallel pg_dump -Fd -j DUMP_JOBS, uploading each table file as it finishes
+#   "incremental" - content-defined chunks deduplicated in BACKUP_CHUNK_PREFIX + a small manifest
+BACKUP_MODE = "file"
+
+# Multipart upload part size in MB (S3 minimum is 5 MB, max 10,000 parts)
+MULTIPART_CHUNK_MB = 64
+
+# Parts uploaded in parallel while streaming (memory ≈ (workers + 1) × part size)
+STREAM_UPLOAD_WORKERS = 4
+
+# Parallel pg_dump worker jobs for "directory" mode
+DUMP_JOBS = 4
+
+# Concurrent S3 uploads of per-table dump files in "directory" mode
+BACKUP_UPLOAD_WORKERS = 8
+
+# Backup compression codec:
+#   "gzip"  - single-threaded gzip
+#   "pgzip" - block-parallel gzip on all cores (still a standard .gz)
+#   "zstd"  - multi-threaded zstd with long-range matching (pip install zstandard)
+BACKUP_CODEC = "gzip"
+
+# Default level per codec: gzip 6 is nearly as small as 9 on SQL text and
+# several times faster; zstd 3 is its own default (zstd 6 is much slower).
+# Also used for pg_dump -Z in "directory" mode.
+BACKUP_COMPRESSION_LEVELS = {"gzip": 6, "pgzip": 6, "zstd": 3}
+
+# Override the per-codec default above (None = use it)
+BACKUP_COMPRESSION_LEVEL = None
+
+# Threads for pgzip/zstd (0 = all cores)
+COMPRESSION_THREADS = 0
+
+# Incremental backups: shared chunk store and average chunk size
+BACKUP_CHUNK_PREFIX = f"{BACKUP_PREFIX}/chunks"
+CHUNK_AVG_KB = 1024
+
+# Unreferenced chunks younger than this are kept (a running backup may not
+# have written its manifest yet). Backups refresh reused chunks older than
+# half of it, so an incremental backup must finish within that half (it
+# fails before writing its manifest otherwise)
+CHUNK_GC_GRACE_HOURS = 24
+
+# Restore (restore_from_s3.py)
+RESTORE_DB_NAME = "saas_platform_restore"
+RESTORE_JOBS = 4                 # pg_restore -j for directory-format backups
+RESTORE_DOWNLOAD_WORKERS = 8     # parallel ranged GETs / file downloads
+RESTORE_RANGE_MB = 16            # size of each ranged GET
+
+# Backup verification: restore each new backup into a throwaway database and
+# compare row counts + sampled checksums with the source (runs in the background)
+VERIFY_BACKUP = False
+VERIFY_DB_NAME = "saas_platform_verify"
+VERIFY_SAMPLE_EVERY = 100        # checksum rows whose id is a multiple of this
@@ -1,10 +1,23 @@
 
+import io
 import os
-import random
-import pandas as pd 
-from datetime import datetime
+import re
+import time
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
-random.seed(42)
+import config
+from parquet_writer import PartitionWriter
+from partitions import partition_path, write_partitions_file
+from rollups import update_rollups
+
+# Master seed: the same seed always produces the same files
+SEED = 42
 
 OUTPUT_DIR = "output"
 
@@ -25,99 +38,260 @@ USERS = [
     {"id": 5, "email": "eve@example.com"},
 ]
 
+# Lookup columns: rows pick from these by random index (Arrow take)
+USER_IDS = pa.array([user["id"] for user in USERS], pa.int64())
+USER_EMAILS = pa.array([user["email"] for user in USERS])
+CURRENCIES = pa.array(["USD", "EUR", "GBP"])
+STATUSES = pa.array(["completed", "pending", "refunded"])
+EVENT_TYPES = pa.array(["login", "logout", "page_view", "purchase", "signup"])
+DEVICES = pa.array(["mobile", "desktop", "tablet"])
+PLANS = pa.array(["free", "pro", "enterprise"])
+
+# Known event properties get their own columns; the rest go into this map
+PROPERTIES_TYPE = pa.map_(pa.string(), pa.string())
+
+
+def pick(rng, values, n):
+    """n random picks from a lookup column."""
+    return values.take(rng.integers(0, len(values), n))
+
+
+def sequential_ids(prefix, date, n, first_id=1):
+    """IDs like ord_20250110_0001, built as one Arrow string column."""
+    numbers = pc.cast(pa.array(np.arange(first_id, first_id + n)), pa.string())
+    return pc.binary_join_element_wise(
+        f"{prefix}_{date.strftime('%Y%m%d')}_", pc.utf8_lpad(numbers, 4, "0"), ""
+    )
+
+
+def random_timestamps(rng, date, n):
+    """Millisecond timestamps at random seconds within the day."""
+    day_start = np.datetime64(date.strftime("%Y-%m-%d"), "ms")
+    seconds = rng.integers(0, 24 * 60 * 60, n).astype("timedelta64[s]")
+    return pa.array(day_start + seconds, pa.timestamp("ms"))
+
+
+def purchase_properties(rng, event_types):
+    """Map column holding {"plan": ...} for purchases and {} otherwise."""
+    is_purchase = pc.equal(event_types, "purchase").to_numpy(zero_copy_only=False)
+    count = int(is_purchase.sum())
+    offsets = np.concatenate([[0], np.cumsum(is_purchase)]).astype(np.int32)
+    return pa.MapArray.from_arrays(
+        pa.array(offsets),
+        pa.array(["plan"] * count),
+        pick(rng, PLANS, count),
+        type=PROPERTIES_TYPE
+    )
+
+
+def generate_orders(date, num_orders, rng, first_id=1):
+    """Generate random order records for one day as an Arrow table."""
+    return pa.table({
+        "order_id": sequential_ids("ord", date, num_orders, first_id),
+        "user_id": pick(rng, USER_IDS, num_orders),
+        "amount": np.round(rng.uniform(5.0, 500.0, num_orders), 2),
+        "currency": pick(rng, CURRENCIES, num_orders),
+        "status": pick(rng, STATUSES, num_orders),
+        "created_at": random_timestamps(rng, date, num_orders),
+    })
+
+
+def generate_events(date, num_events, rng, first_id=1):
+    """Generate random event records for one day as an Arrow table."""
+    # Email must belong to the same user as user_id
+    user_index = rng.integers(0, len(USERS), num_events)
+    event_types = pick(rng, EVENT_TYPES, num_events)
+
+    return pa.table({
+        "event_id": sequential_ids("evt", date, num_events, first_id),
+        "user_id": USER_IDS.take(user_index),
+        "user_email": USER_EMAILS.take(user_index),
+        "event_type": event_types,
+        "device": pick(rng, DEVICES, num_events),
+        "properties": purchase_properties(rng, event_types),
+        "created_at": random_timestamps(rng, date, num_events),
+    })
+
 
-def generate_orders(date, num_orders):
-    """Generate random order records for one day."""
-    records = []
-    for i in range(num_orders):
-        records.append({
-            "order_id": f"ord_{date.strftime('%Y%m%d')}_{i+1:04d}",
-            "user_id": random.choice(USERS)["id"],
-            "amount": round(random.uniform(5.0, 500.0), 2),
-            "currency": random.choice(["USD", "EUR", "GBP"]),
-            "status": random.choice(["completed", "pending", "refunded"]),
-            "created_at": date.replace(
-                hour=random.randint(0, 23),
-                minute=random.randint(0, 59),
-                second=random.randint(0, 59)
-            ).isoformat(),
-        })
-    return pd.DataFrame(records)
-
-
-def generate_events(date, num_events):
-    """Generate random event records for one day."""
-    records = []
-    for i in range(num_events):
-        user = random.choice(USERS)
-        event_type = random.choice(["login", "logout", "page_view", "purchase", "signup"])
-
-        records.append({
-            "event_id": f"evt_{date.strftime('%Y%m%d')}_{i+1:04d}",
-            "user_id": user["id"],
-            "user_email": user["email"],
-            "event_type": event_type,
-            "properties": str({"device": random.choice(["mobile", "desktop", "tablet"])}),
-            "created_at": date.replace(
-                hour=random.randint(0, 23),
-                minute=random.randint(0, 59),
-                second=random.randint(0, 59)
-            ).isoformat(),
-        })
-    return pd.DataFrame(records)
-
-
-def save_parquet(df, table_name, date):
-    """Save DataFrame as a Parquet file in a partitioned directory."""
-    partition_path = os.path.join(
-        OUTPUT_DIR,
-        table_name,
-        f"year={date.year}",
-        f"month={date.month:02d}",
-        f"day={date.day:02d}"
+# Table name → generator, plus a stable id used to derive partition seeds
+TABLES = {
+    "orders": generate_orders,
+    "events": generate_events,
+}
+TABLE_SEED_IDS = {"orders": 1, "events": 2}
+
+# Row counts used when no --rows-per-day/--target-size is given
+DEFAULT_ROWS = {"orders": (5, 16), "events": (10, 31)}
+
+# Rows generated per batch, so huge partitions never sit in memory at once
+BATCH_ROWS = 1_000_000
+
+
+def partition_rng(seed, table_name, date):
+    """Random generator for one partition, derived from the master seed.
+
+    Each partition gets its own stream, so the output is identical no
+    matter how many worker processes generate it or in which order.
+    """
+    sequence = np.random.SeedSequence(
+        [seed, TABLE_SEED_IDS[table_name], date.toordinal()]
     )
-    os.makedirs(partition_path, exist_ok=True)
+    return np.random.default_rng(sequence)
+
 
-    filepath = os.path.join(partition_path, "data.parquet")
-    df.to_parquet(filepath, engine="pyarrow", index=False)
+def generate_partition(task):
+    """Generate and write one table/day partition (runs in a worker process).
 
-    size = os.path.getsize(filepath)
-    print(f"{filepath}")
-    print(f"{len(df)} rows, {size:,} bytes")
+    Batches are streamed through a PartitionWriter, which clusters the
+    rows by CLUSTER_KEYS in runs of at most CLUSTER_RUN_ROWS (merged on
+    close) and rolls to a new part file at
+    PARQUET_TARGET_FILE_MB. Returns [{path, rows, bytes}, ...].
+    """
+    seed, table_name, date, rows = task
+    rng = partition_rng(seed, table_name, date)
+    if rows is None:
+        rows = int(rng.integers(*DEFAULT_ROWS[table_name]))
 
+    directory = os.path.join(OUTPUT_DIR, *partition_path(table_name, date).split("/"))
+    generate = TABLES[table_name]
+
+    cluster_keys = config.CLUSTER_KEYS.get(table_name)
+    with PartitionWriter(directory, cluster_keys=cluster_keys) as writer:
+        for first in range(0, max(rows, 1), BATCH_ROWS):
+            writer.write(
+                generate(date, min(BATCH_ROWS, rows - first), rng, first_id=first + 1)
+            )
+    return writer.files
+
+
+def parse_size(text):
+    """Parse sizes like '500MB', '10GB' or '1.5TB' into bytes."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?B?)\s*", text.upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {text!r}")
+    number, unit = match.groups()
+    power = "BKMGT".index(unit[0]) if unit else 0
+    return int(float(number) * 1024 ** power)
+
+
+def estimate_row_bytes(seed, sample_rows=100_000):
+    """Compressed Parquet bytes per row (orders + events) from a sample."""
+    total = 0
+    for table_name, generate in TABLES.items():
+        rng = partition_rng(seed, table_name, DATES[0])
+        sample = generate(DATES[0], sample_rows, rng)
+        buffer = io.BytesIO()
+        pq.write_table(sample, buffer)
+        total += buffer.tell() / sample_rows
+    return total
+
+
+def date_range(start, end):
+    """Every date from start to end, inclusive."""
+    days = (end - start).days
+    return [start + timedelta(days=i) for i in range(days + 1)]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the sample data lake")
+    parser.add_argument(
+        "--start", type=datetime.fromisoformat,
+        help="first date (YYYY-MM-DD); default: the built-in sample dates"
+    )
+    parser.add_argument(
+        "--end", type=datetime.fromisoformat,
+        help="last date, inclusive (default: --start)"
+    )
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument(
+        "--rows-per-day", type=int,
+        help="rows per table per day"
+    )
+    size.add_argument(
+        "--target-size", type=parse_size,
+        help="approximate total lake size, e.g. 1GB, 10GB, 100GB"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="worker processes (default: all cores)"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=SEED,
+        help=f"master seed (default: {SEED})"
+    )
+    args = parser.parse_args(argv)
+
+    # Projected tables can't see dates outside the projection's year range
+    if config.ATHENA_PARTITION_PROJECTION and args.start:
+        first_year, last_year = config.ATHENA_PROJECTION_YEARS
+        for date in (args.start, args.end or args.start):
+            if not first_year <= date.year <= last_year:
+                parser.error(
+                    f"{date:%Y-%m-%d} is outside ATHENA_PROJECTION_YEARS "
+                    f"({first_year}-{last_year}); Athena would never read it"
+                )
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
 
-def main():
     print("=" * 55)
     print("  Generating Data Lake Files")
     print("=" * 55)
     print()
 
-    total_orders = 0
-    total_events = 0
+    if args.start:
+        dates = date_range(args.start, args.end or args.start)
+    else:
+        dates = DATES
 
-    for date in DATES:
-        date_str = date.strftime("%Y-%m-%d")
-        print(f"{date_str}")
+    rows_per_day = args.rows_per_day
+    if args.target_size:
+        row_bytes = estimate_row_bytes(args.seed)
+        rows_per_day = max(1, int(args.target_size / (len(dates) * row_bytes)))
+        print(f"Target {args.target_size:,} bytes over {len(dates)} day(s) "
+              f"→ {rows_per_day:,} rows per table per day")
+        print()
 
-        # Generate orders
-        num_orders = random.randint(5, 15)
-        orders_df = generate_orders(date, num_orders)
-        save_parquet(orders_df, "orders", date)
-        total_orders += num_orders
+    tasks = [
+        (args.seed, table_name, date, rows_per_day)
+        for date in dates
+        for table_name in TABLES
+    ]
 
-        # Generate events
-        num_events = random.randint(10, 30)
-        events_df = generate_events(date, num_events)
-        save_parquet(events_df, "events", date)
-        total_events += num_events
+    started = time.monotonic()
+    totals = {table_name: 0 for table_name in TABLES}
+    total_bytes = 0
+    written = []
 
-        print()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for (_, table_name, date, _), files in zip(
+            tasks, pool.map(generate_partition, tasks)
+        ):
+            for file in files:
+                print(f"{file['path']}")
+                print(f"{file['rows']:,} rows, {file['bytes']:,} bytes")
+                totals[table_name] += file["rows"]
+                total_bytes += file["bytes"]
+            written.append(partition_path(table_name, date))
+
+    rollup_partitions = update_rollups(written)
+    print(f"{len(rollup_partitions)} rollup partition(s) updated")
 
+    elapsed = time.monotonic() - started
+    total_rows = sum(totals.values())
+    partitions_file = write_partitions_file(written + rollup_partitions)
+
+    print()
     print("=" * 55)
-    print(f"Generated {total_orders} orders + {total_events} events")
+    print(f"Generated {totals['orders']:,} orders + {totals['events']:,} events")
+    print(f"{total_bytes:,} bytes in {elapsed:.1f}s with {args.workers} worker(s) "
+          f"({total_rows / elapsed if elapsed else 0:,.0f} rows/s)")
     print(f"Files saved in: {OUTPUT_DIR}/")
+    print(f"Partitions listed in: {partitions_file}")
     print("=" * 55)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
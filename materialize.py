@@ -0,0 +1,194 @@
+
+import io
+import os
+import re
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import config
+from query_cache import normalize_sql
+from s3_utils import delete_keys, list_objects
+
+
+ORDER_BY = re.compile(r"\border\s+by\b", re.IGNORECASE)
+# What follows the last top-level ORDER BY: its terms and an optional LIMIT
+ORDER_BY_TAIL = re.compile(
+    r"(?P<terms>.*?)(?P<limit>\s+limit\s+\d+)?\s*;?\s*", re.IGNORECASE | re.DOTALL
+)
+SELECT_LIST = re.compile(r"^\s*select\s+(?:distinct\s+)?", re.IGNORECASE)
+FROM = re.compile(r"\bfrom\b", re.IGNORECASE)
+OUTPUT_NAME = re.compile(r'(?:\bas\s+)?("[^"]+"|\w+)\s*$', re.IGNORECASE)
+# Output column (name, quoted name or 1-based position) with a direction
+ORDER_TERM = re.compile(
+    r'\s*(?P<column>\w+|"[^"]+")(?:\s+(?P<direction>asc|desc))?(?:\s+nulls\s+last)?\s*',
+    re.IGNORECASE
+)
+
+
+def top_level(text, pattern):
+    """Matches of pattern that are outside any parentheses."""
+    return [
+        match for match in pattern.finditer(text)
+        if text[:match.start()].count("(") == text[:match.start()].count(")")
+    ]
+
+
+def output_columns(query):
+    """Output column names of the outer SELECT list, None if it has a *.
+
+    Expressions without an alias have no usable name and are listed as
+    None, so positions still line up with ORDER BY 1, 2, ...
+    """
+    select = SELECT_LIST.match(query)
+    froms = top_level(query, FROM)
+    if not select or not froms:
+        return []
+    columns = query[select.end():froms[0].start()]
+    names = []
+    start = 0
+    for comma in top_level(columns, re.compile(",")) + [None]:
+        item = columns[start:comma.start() if comma else len(columns)].strip()
+        if item == "*" or item.endswith(".*"):
+            return None
+        name = OUTPUT_NAME.search(item)
+        names.append(name.group(1).strip('"') if name else None)
+        start = comma.end() if comma else start
+    return names
+
+
+def split_order_by(query):
+    """(query for UNLOAD, sort keys to reapply on the client).
+
+    UNLOAD writes parts in no particular order, so a trailing ORDER BY
+    is taken off the query (kept if a LIMIT depends on it) and returned
+    as [(column, "ascending"/"descending")], where column is an output
+    name or 1-based position. Keys are None if the ORDER BY sorts by
+    expressions the output columns can't reproduce.
+    """
+    # The query's own ORDER BY is the last one outside any parentheses
+    order_bys = top_level(query, ORDER_BY)
+    if not order_bys:
+        return query, []
+    order_by = order_bys[-1]
+    match = ORDER_BY_TAIL.fullmatch(query, order_by.end())
+    names = output_columns(query)
+
+    keys = []
+    for term in match.group("terms").split(","):
+        term_match = ORDER_TERM.fullmatch(term)
+        if not term_match:
+            return query, None
+        column = term_match.group("column").strip('"')
+        if names is not None and (
+                int(column) > len(names) if column.isdigit() else column not in names):
+            return query, None
+        direction = (term_match.group("direction") or "asc").lower()
+        keys.append((
+            int(column) if column.isdigit() else column,
+            "descending" if direction == "desc" else "ascending",
+        ))
+    if match.group("limit"):
+        return query, keys
+    return query[:order_by.start()], keys
+
+
+def sort_result(table, keys):
+    """Reapply split_order_by() keys to a result table (nulls last)."""
+    if not keys or table.num_rows == 0:
+        return table
+    names = table.column_names
+    return table.sort_by([
+        (names[column - 1] if isinstance(column, int) else column, direction)
+        for column, direction in keys
+    ])
+
+
+def derived_location(key):
+    """S3 prefix (without bucket) that holds one query's Parquet output."""
+    return f"{config.DERIVED_PREFIX}/{key[:32]}/"
+
+
+def unload_statement(query, location):
+    """Wrap a SELECT in UNLOAD so Athena writes Parquet instead of CSV."""
+    return (
+        f"UNLOAD ({query.strip().rstrip(';')})\n"
+        f"TO 's3://{config.BUCKET_NAME}/{location}'\n"
+        f"WITH (format = 'PARQUET', compression = 'SNAPPY')"
+    )
+
+
+def load_registry():
+    """Materialized results: query key → location, SQL hash, bytes, created."""
+    if not os.path.exists(config.MATERIALIZED_REGISTRY_FILE):
+        return {}
+    with open(config.MATERIALIZED_REGISTRY_FILE) as f:
+        return json.load(f)
+
+
+def save_registry(registry):
+    with open(config.MATERIALIZED_REGISTRY_FILE, "w") as f:
+        json.dump(registry, f, indent=1, sort_keys=True)
+
+
+def find_materialized(s3, key):
+    """Registry entry for key if its Parquet parts are still in S3."""
+    entry = load_registry().get(key)
+    if entry and list_objects(s3, entry["location"]):
+        return entry
+    return None
+
+
+def prepare_location(s3, key):
+    """Empty derived location for a new UNLOAD (it refuses non-empty ones)."""
+    location = derived_location(key)
+    leftovers = [obj["Key"] for obj in list_objects(s3, location)]
+    if leftovers:
+        delete_keys(s3, leftovers)
+    return location
+
+
+def register(s3, key, query, location, data_scanned):
+    """Record a finished UNLOAD, replacing older results of the same SQL.
+
+    The older result was computed over partitions that have since
+    changed (otherwise its key would match), so its files are deleted.
+    """
+    registry = load_registry()
+    sql_hash = hashlib.sha256(normalize_sql(query).encode()).hexdigest()
+    for old_key, entry in list(registry.items()):
+        if entry["sql_hash"] == sql_hash and old_key != key:
+            delete_keys(s3, [obj["Key"] for obj in list_objects(s3, entry["location"])])
+            del registry[old_key]
+
+    registry[key] = {
+        "location": location,
+        "sql_hash": sql_hash,
+        "DataScannedInBytes": data_scanned,
+        "created": time.time(),
+    }
+    save_registry(registry)
+
+
+def read_parquet_parts(s3, location, workers=None):
+    """Download every Parquet part under a location in parallel as one table.
+
+    Row order across parts isn't guaranteed, as with any UNLOAD output;
+    reapply the query's ORDER BY with sort_result().
+    """
+    keys = sorted(
+        obj["Key"] for obj in list_objects(s3, location) if obj["Size"] > 0
+    )
+
+    def fetch(key):
+        body = s3.get_object(Bucket=config.BUCKET_NAME, Key=key)["Body"].read()
+        return pq.read_table(io.BytesIO(body))
+
+    with ThreadPoolExecutor(max_workers=workers or config.MATERIALIZE_READ_WORKERS) as pool:
+        tables = list(pool.map(fetch, keys))
+    if not tables:
+        return pa.table({})
+    return pa.concat_tables(tables, promote_options="default")
@@ -0,0 +1,199 @@
+
+import os
+import glob
+import shutil
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import config
+from clustering import cluster_table, merge_sorted_runs
+
+
+class PartitionWriter:
+    """Stream Arrow data into one partition directory as right-sized files.
+
+    Rows are buffered until a full row group (PARQUET_ROW_GROUP_ROWS) is
+    available, so every row group has the configured size no matter how
+    the input is batched. After each row group the file size is checked
+    and the writer rolls over to the next part-NNNNN.parquet once it
+    reaches PARQUET_TARGET_FILE_MB, overshooting by at most one row group.
+
+    With cluster_keys, rows are reordered by clustering.cluster_table() so
+    each row group covers a narrow range of the keys and min/max statistics
+    can prune it. Up to CLUSTER_RUN_ROWS rows are clustered in memory; past
+    that, "sort" spills sorted runs to a hidden folder and merges them on
+    close, and "zorder" clusters and writes each run on its own.
+    """
+
+    def __init__(self, directory, prefix="part", overwrite=True,
+                 target_mb=None, row_group_rows=None, codec=None,
+                 compression_level=None, dictionary_columns=None,
+                 write_statistics=None, cluster_keys=None, cluster_method=None,
+                 run_rows=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.target_bytes = (target_mb or config.PARQUET_TARGET_FILE_MB) * 1024 * 1024
+        self.row_group_rows = row_group_rows or config.PARQUET_ROW_GROUP_ROWS
+        self.cluster_method = cluster_method or config.CLUSTER_METHOD
+        self.cluster_keys = cluster_keys if self.cluster_method != "none" else None
+        self.run_rows = run_rows or config.CLUSTER_RUN_ROWS
+        self.options = {
+            "compression": codec or config.PARQUET_CODEC,
+            "compression_level": (
+                compression_level if compression_level is not None
+                else config.PARQUET_COMPRESSION_LEVEL
+            ),
+            "use_dictionary": (
+                dictionary_columns if dictionary_columns is not None
+                else config.PARQUET_DICTIONARY_COLUMNS
+            ),
+            "write_statistics": (
+                write_statistics if write_statistics is not None
+                else config.PARQUET_WRITE_STATISTICS
+            ),
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        if overwrite:
+            for old in glob.glob(os.path.join(directory, "*.parquet")):
+                os.remove(old)
+            # Runs left behind by an interrupted clustered write
+            for old in glob.glob(os.path.join(directory, ".runs-*")):
+                shutil.rmtree(old, ignore_errors=True)
+
+        self.files = []
+        self._schema = None
+        self._pending = []
+        self._pending_rows = 0
+        self._writer = None
+        self._sink = None
+        self._file_rows = 0
+        self._runs = []
+        self._run_dir = None
+
+    def _open_next(self):
+        path = os.path.join(
+            self.directory, f"{self.prefix}-{len(self.files):05d}.parquet"
+        )
+        self._sink = pa.OSFile(path, "wb")
+        # Dictionary-encode only columns that exist in this table
+        options = dict(self.options)
+        if isinstance(options["use_dictionary"], (list, tuple)):
+            options["use_dictionary"] = [
+                name for name in options["use_dictionary"]
+                if name in self._schema.names
+            ]
+        self._writer = pq.ParquetWriter(self._sink, self._schema, **options)
+        self._file_rows = 0
+        self.files.append({"path": path, "rows": 0, "bytes": 0})
+
+    def _close_current(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._sink.close()
+        self.files[-1]["rows"] = self._file_rows
+        self.files[-1]["bytes"] = os.path.getsize(self.files[-1]["path"])
+        self._writer = None
+        self._sink = None
+
+    def _write_row_group(self, table):
+        if self._writer is None:
+            self._open_next()
+        self._writer.write_table(table, row_group_size=len(table))
+        self._file_rows += len(table)
+        if self._sink.tell() >= self.target_bytes:
+            self._close_current()
+
+    def _flush(self, final=False):
+        if not self._pending:
+            return
+        table = pa.concat_tables(self._pending)
+        offset = 0
+        while len(table) - offset >= self.row_group_rows:
+            self._write_row_group(table.slice(offset, self.row_group_rows))
+            offset += self.row_group_rows
+        remainder = table.slice(offset)
+        if final and len(remainder):
+            self._write_row_group(remainder)
+            remainder = remainder.slice(0, 0)
+        self._pending = [remainder] if len(remainder) else []
+        self._pending_rows = len(remainder)
+
+    def _add(self, table):
+        self._pending.append(table)
+        self._pending_rows += len(table)
+
+    def _spill_run(self):
+        """Cluster the buffered rows as one run and get them out of memory."""
+        run = cluster_table(
+            pa.concat_tables(self._pending), self.cluster_keys, self.cluster_method
+        )
+        self._pending = []
+        self._pending_rows = 0
+        if self.cluster_method != "sort":
+            # Z-order ranks are per run, so runs can't be merged: write it now
+            self._add(run)
+            self._flush()
+            return
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix=".runs-", dir=self.directory)
+        path = os.path.join(self._run_dir, f"run-{len(self._runs):05d}.parquet")
+        pq.write_table(run, path, compression="snappy")
+        self._runs.append(path)
+
+    def _merge_runs(self):
+        """Stream the spilled runs back in key order through the row groups."""
+        batch_rows = max(self.run_rows // len(self._runs), 1024)
+        runs = [
+            (pa.Table.from_batches([batch])
+             for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows))
+            for path in self._runs
+        ]
+        try:
+            for table in merge_sorted_runs(runs, self.cluster_keys):
+                self._add(table)
+                if self._pending_rows >= self.row_group_rows:
+                    self._flush()
+        finally:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+            self._runs = []
+
+    def write(self, data):
+        """Add an Arrow Table or RecordBatch."""
+        if isinstance(data, pa.RecordBatch):
+            data = pa.Table.from_batches([data])
+        if self._schema is None:
+            self._schema = data.schema
+        self._add(data)
+        if self.cluster_keys:
+            if self._pending_rows >= self.run_rows:
+                self._spill_run()
+        elif self._pending_rows >= self.row_group_rows:
+            self._flush()
+
+    def close(self):
+        """Flush remaining rows; returns [{path, rows, bytes}, ...] per file."""
+        if self.cluster_keys and self._pending:
+            if self._runs:
+                self._spill_run()
+            else:
+                self._pending = [cluster_table(
+                    pa.concat_tables(self._pending), self.cluster_keys, self.cluster_method
+                )]
+        if self._runs:
+            self._merge_runs()
+        self._flush(final=True)
+        if not self.files and self._schema is not None:
+            # Keep empty partitions readable: one file with no rows
+            self._open_next()
+        self._close_current()
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
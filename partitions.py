@@ -0,0 +1,54 @@
+
+import os
+import re
+import json
+
+import config
+
+
+# orders/year=2025/month=01/day=10
+PARTITION_DIR = re.compile(
+    r"^(?P<table>.+?)/year=(?P<year>\d+)"
+    r"(?:/month=(?P<month>\d+))?(?:/day=(?P<day>\d+))?$"
+)
+
+
+def partition_path(table, date):
+    """Relative Hive-style partition directory for a table and date."""
+    return f"{table}/year={date.year}/month={date.month:02d}/day={date.day:02d}"
+
+
+def partition_of(relative_path):
+    """Partition directory of a lake file, or None if it isn't partitioned."""
+    directory = relative_path.rsplit("/", 1)[0] if "/" in relative_path else ""
+    return directory if PARTITION_DIR.match(directory) else None
+
+
+def parse_partition(partition):
+    """Split 'orders/year=2025/month=01/day=10' into table and int values."""
+    match = PARTITION_DIR.match(partition)
+    if not match:
+        raise ValueError(f"Not a partition path: {partition!r}")
+    values = {
+        key: int(value)
+        for key, value in match.groupdict().items()
+        if key != "table" and value is not None
+    }
+    return {"table": match.group("table"), **values}
+
+
+def write_partitions_file(partitions, path=None):
+    """Record touched partitions for incremental downstream steps."""
+    path = path or config.TOUCHED_PARTITIONS_FILE
+    with open(path, "w") as f:
+        json.dump(sorted(set(partitions)), f, indent=2)
+    return path
+
+
+def read_partitions_file(path=None):
+    """Load a touched-partitions file written by write_partitions_file()."""
+    path = path or config.TOUCHED_PARTITIONS_FILE
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
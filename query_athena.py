@@ -1,77 +1,178 @@
 
 import time
+import argparse
+
 import boto3
 import config
+from athena_executor import AthenaExecutor
+from athena_results import read_results
+from local_engine import LocalEngine
+from materialize import (
+    find_materialized, prepare_location, read_parquet_parts, register, sort_result,
+    split_order_by, unload_statement
+)
+from query_cache import QueryCache, query_key
+from query_planner import QueryRejected, check_budget, plan_query
+
+
+def submit_query(executor, query, s3=None, cache=None, allow_large=False,
+                 materialize=False):
+    """Plan a query, then start it unless the cache can answer it.
+
+    Returns a dict with the (possibly rewritten) "query", its "plan", and
+    either "cached" ((table, metadata)), "materialized" (a reusable
+    registry entry), "future" or "error" (rejected by the byte budget).
+    With materialize, the query runs as an UNLOAD to Parquet under
+    DERIVED_PREFIX and "location" says where; its ORDER BY is kept in
+    "order" and reapplied to the parts. Queries ordered by expressions
+    that can't be reapplied run normally and say so in "note".
+    """
+    local_root = executor.root if isinstance(executor, LocalEngine) else None
+    plan = plan_query(query, s3=s3, local_root=local_root)
+    submitted = {"query": plan["query"], "plan": plan, "future": None,
+                 "cache_key": None, "cached": None, "error": None,
+                 "key": None, "materialized": None, "location": None,
+                 "order": [], "note": None}
+    try:
+        check_budget(plan, allow_large)
+    except QueryRejected as e:
+        submitted["error"] = str(e)
+        return submitted
+
+    if cache:
+        submitted["cache_key"] = cache.key(s3, plan["query"], plan["prefixes"])
+        submitted["cached"] = cache.get(submitted["cache_key"])
+    if submitted["cached"]:
+        return submitted
+
+    materialize = materialize and not local_root
+    unload_query, order = split_order_by(plan["query"]) if materialize else (None, [])
+    if materialize and order is None:
+        submitted["note"] = "not materialized: ORDER BY can't be reapplied to UNLOAD output"
+    elif materialize:
+        key = submitted["cache_key"] or query_key(s3, plan["query"], plan["prefixes"])
+        submitted["key"] = key
+        submitted["order"] = order
+        submitted["materialized"] = find_materialized(s3, key)
+        if not submitted["materialized"]:
+            submitted["location"] = prepare_location(s3, key)
+            submitted["future"] = executor.submit(
+                unload_statement(unload_query, submitted["location"]),
+                database=config.ATHENA_DATABASE
+            )
+        return submitted
+
+    submitted["future"] = executor.submit(
+        plan["query"], database=config.ATHENA_DATABASE
+    )
+    return submitted
 
 
-def run_query_and_show_results(athena_client, query, description):
-    """Run an Athena query, wait for results, and display them."""
+def run_query_and_show_results(executor, query, description, s3=None, cache=None,
+                               submitted=None, allow_large=False, materialize=False):
+    """Run an Athena query, wait for results, and display them.
+
+    Every query is planned first: created_at ranges become partition
+    filters and scans over QUERY_BYTE_BUDGET_MB are refused unless
+    allow_large. Pass the result of submit_query() to only wait and
+    print. With an S3 client, large results are downloaded from the
+    result CSV; with a QueryCache, unchanged partitions are answered
+    without running Athena. With materialize, results are written as
+    Parquet by UNLOAD, read back in parallel, re-sorted by the query's
+    ORDER BY and reused next time.
+    """
+    started = time.monotonic()
+    submitted = submitted or submit_query(
+        executor, query, s3, cache, allow_large, materialize
+    )
+    plan = submitted["plan"]
+    cached = submitted["cached"]
+
     print("─" * 60)
     print(f"{description}")
     print(f"   SQL: {query.strip()}")
+    if plan["rewritten"]:
+        print(f"   Rewritten: {plan['query'].strip()}")
+    print(f"   Planned scan: ~{plan['bytes']:,} bytes in "
+          f"{len(plan['partitions'])} partition(s)")
+    if submitted["note"]:
+        print(f"   Note: {submitted['note']}")
     print()
 
-    # Start query
-    response = athena_client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": config.ATHENA_DATABASE},
-        ResultConfiguration={
-            "OutputLocation": f"s3://{config.BUCKET_NAME}/athena-results/"
-        }
-    )
-    execution_id = response["QueryExecutionId"]
-
-    # Wait for completion
-    while True:
-        result = athena_client.get_query_execution(
-            QueryExecutionId=execution_id
-        )
-        state = result["QueryExecution"]["Status"]["State"]
+    if submitted["error"]:
+        print(f"   ✗ Rejected: {submitted['error']}")
+        print()
+        return
 
-        if state == "SUCCEEDED":
-            break
-        elif state in ("FAILED", "CANCELLED"):
-            reason = result["QueryExecution"]["Status"].get(
-                "StateChangeReason", "Unknown"
-            )
+    if cached:
+        table, metadata = cached
+        elapsed_ms = (time.monotonic() - started) * 1000
+        print(f"   Data scanned: 0 bytes (0.0 KB) — cache hit, "
+              f"{metadata.get('DataScannedInBytes', 0):,} bytes saved")
+        print(f"   Execution time: {elapsed_ms:.0f} ms (from {config.QUERY_CACHE_DIR}/)")
+        print()
+    elif submitted["materialized"]:
+        entry = submitted["materialized"]
+        table = sort_result(read_parquet_parts(s3, entry["location"]), submitted["order"])
+        elapsed_ms = (time.monotonic() - started) * 1000
+        print(f"   Data scanned: 0 bytes (0.0 KB) — reused materialized result, "
+              f"{entry['DataScannedInBytes']:,} bytes saved")
+        print(f"   Execution time: {elapsed_ms:.0f} ms "
+              f"(from s3://{config.BUCKET_NAME}/{entry['location']})")
+        print()
+        if cache:
+            cache.put(submitted["cache_key"], table, entry)
+    else:
+        # Wait for completion
+        execution = submitted["future"].result()
+        state = execution["Status"]["State"]
+        if state != "SUCCEEDED":
+            reason = execution["Status"].get("StateChangeReason", "Unknown")
             print(f"   {state}: {reason}")
             print()
             return
-        time.sleep(2)
 
-    # Get statistics
-    stats = result["QueryExecution"]["Statistics"]
-    data_scanned = stats.get("DataScannedInBytes", 0)
-    exec_time = stats.get("EngineExecutionTimeInMillis", 0)
+        # Get statistics
+        stats = execution["Statistics"]
+        data_scanned = stats.get("DataScannedInBytes", 0)
+        exec_time = stats.get("EngineExecutionTimeInMillis", 0)
+        cache_note = " — cache miss" if cache else ""
 
-    print(f"   Data scanned: {data_scanned:,} bytes ({data_scanned/1024:.1f} KB)")
-    print(f"   Execution time: {exec_time} ms")
-    print()
-
-    # Get results
-    results = athena_client.get_query_results(
-        QueryExecutionId=execution_id
-    )
+        print(f"   Data scanned: {data_scanned:,} bytes "
+              f"({data_scanned/1024:.1f} KB){cache_note}")
+        print(f"   Execution time: {exec_time} ms")
+        print()
 
-    rows = results["ResultSet"]["Rows"]
+        # Get results: all pages, typed by the result set's column metadata
+        if "ResultTable" in execution:
+            table = execution["ResultTable"]
+        elif submitted["location"]:
+            table = sort_result(
+                read_parquet_parts(s3, submitted["location"]), submitted["order"]
+            )
+            register(s3, submitted["key"], plan["query"], submitted["location"],
+                     data_scanned)
+        else:
+            table = read_results(executor.client, execution, s3=s3)
+        if cache:
+            cache.put(submitted["cache_key"], table, {"DataScannedInBytes": data_scanned})
 
-    if not rows:
+    if table.num_rows == 0:
         print("   (no results)")
         print()
         return
 
-    # First row is the header
-    headers = [col.get("VarCharValue", "") for col in rows[0]["Data"]]
+    headers = table.column_names
+    shown = table.slice(0, config.ATHENA_DISPLAY_ROWS).to_pylist()
 
     # Calculate column widths for nice formatting
     col_widths = [len(h) for h in headers]
     data_rows = []
-    for row in rows[1:]:
-        values = [col.get("VarCharValue", "") for col in row["Data"]]
+    for row in shown:
+        values = ["" if row[h] is None else str(row[h]) for h in headers]
         data_rows.append(values)
         for i, val in enumerate(values):
-            if i < len(col_widths):
-                col_widths[i] = max(col_widths[i], len(val))
+            col_widths[i] = max(col_widths[i], len(val))
 
     # Print header
     header_line = " | ".join(
@@ -83,80 +184,149 @@ def run_query_and_show_results(athena_client, query, description):
     # Print data rows
     for values in data_rows:
         row_line = " | ".join(
-            v.ljust(col_widths[i]) if i < len(col_widths) else v
-            for i, v in enumerate(values)
+            v.ljust(col_widths[i]) for i, v in enumerate(values)
         )
         print(f"   {row_line}")
 
-    print(f"\n   ({len(data_rows)} rows)")
+    if table.num_rows > len(data_rows):
+        print(f"   ... {table.num_rows - len(data_rows):,} more rows")
+    print(f"\n   ({table.num_rows:,} rows)")
     print()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the report queries")
+    parser.add_argument(
+        "--allow-large", action="store_true",
+        help=f"run queries over the {config.QUERY_BYTE_BUDGET_MB} MB scan budget"
+    )
+    parser.add_argument(
+        "--materialize", action="store_true", default=config.QUERY_MATERIALIZE,
+        help="run queries as UNLOAD to Parquet and reuse earlier results"
+    )
+    args = parser.parse_args()
+
     print("=" * 60)
     print("  Running Athena Queries on Data Lake")
     print("  All queries use partition filters!")
     print("=" * 60)
     print()
 
-    athena = boto3.client("athena", region_name=config.REGION)
+    if config.QUERY_BACKEND == "local":
+        # In-process DuckDB over output/: no S3, no cost, nothing to cache
+        executor = LocalEngine()
+        s3 = None
+        cache = None
+        print(f"Backend: local DuckDB over {executor.root}/ "
+              f"({', '.join(executor.tables)})")
+        print()
+    else:
+        executor = AthenaExecutor()
+        s3 = boto3.client("s3", region_name=config.REGION)
+        cache = QueryCache() if config.QUERY_CACHE else None
     db = config.ATHENA_DATABASE
 
-    # ── Query 1 ──
-    run_query_and_show_results(
-        athena,
-        f"""
-        SELECT order_id, user_id, amount, currency, status
-        FROM {db}.orders
-        WHERE year = 2025 AND month = 1 AND day = 10
-        ORDER BY amount DESC
-        """,
-        "Orders on 2025-01-10 (single day partition)"
-    )
-
-    # ── Query 2 ──
-    run_query_and_show_results(
-        athena,
-        f"""
-        SELECT status,
-               COUNT(*) as order_count,
-               ROUND(SUM(amount), 2) as total_revenue
-        FROM {db}.orders
-        WHERE year = 2025 AND month = 1
-        GROUP BY status
-        ORDER BY total_revenue DESC
-        """,
-        "Revenue by status — January 2025 (month partition)"
-    )
+    queries = [
+        # ── Query 1 ──
+        (
+            f"""
+            SELECT order_id, user_id, amount, currency, status
+            FROM {db}.orders
+            WHERE year = 2025 AND month = 1 AND day = 10
+            ORDER BY amount DESC
+            """,
+            "Orders on 2025-01-10 (single day partition)"
+        ),
+        # ── Query 2 ──
+        (
+            f"""
+            SELECT status,
+                   COUNT(*) as order_count,
+                   ROUND(SUM(amount), 2) as total_revenue
+            FROM {db}.orders
+            WHERE year = 2025 AND month = 1
+            GROUP BY status
+            ORDER BY total_revenue DESC
+            """,
+            "Revenue by status — January 2025 (month partition)"
+        ),
+        # ── Query 3 ──
+        (
+            f"""
+            SELECT event_type, COUNT(*) as event_count
+            FROM {db}.events
+            WHERE year = 2025 AND month = 1 AND day = 10
+            GROUP BY event_type
+            ORDER BY event_count DESC
+            """,
+            "Event types on 2025-01-10 (single day partition)"
+        ),
+        # ── Query 4 ──
+        (
+            f"""
+            SELECT user_id,
+                   COUNT(*) as total_orders,
+                   ROUND(SUM(amount), 2) as total_spent
+            FROM {db}.orders
+            WHERE year = 2025 AND month = 1
+              AND status = 'completed'
+            GROUP BY user_id
+            ORDER BY total_spent DESC
+            """,
+            "Top spenders in January 2025 (completed orders only)"
+        ),
+    ]
 
-    # ── Query 3 ──
-    run_query_and_show_results(
-        athena,
-        f"""
-        SELECT event_type, COUNT(*) as event_count
-        FROM {db}.events
-        WHERE year = 2025 AND month = 1 AND day = 10
-        GROUP BY event_type
-        ORDER BY event_count DESC
-        """,
-        "Event types on 2025-01-10 (single day partition)"
-    )
+    if config.QUERY_USE_ROLLUPS:
+        # Same answers for queries 2-4 from the kilobyte-sized rollup tables
+        queries[1:] = [
+            (
+                f"""
+                SELECT status,
+                       SUM(order_count) as order_count,
+                       ROUND(SUM(revenue), 2) as total_revenue
+                FROM {db}.monthly_orders_by_status
+                WHERE year = 2025 AND month = 1
+                GROUP BY status
+                ORDER BY total_revenue DESC
+                """,
+                "Revenue by status — January 2025 (monthly rollup)"
+            ),
+            (
+                f"""
+                SELECT event_type, SUM(event_count) as event_count
+                FROM {db}.daily_events_by_type
+                WHERE year = 2025 AND month = 1 AND day = 10
+                GROUP BY event_type
+                ORDER BY event_count DESC
+                """,
+                "Event types on 2025-01-10 (daily rollup)"
+            ),
+            (
+                f"""
+                SELECT user_id,
+                       SUM(order_count) as total_orders,
+                       ROUND(SUM(revenue), 2) as total_spent
+                FROM {db}.monthly_orders_by_user
+                WHERE year = 2025 AND month = 1
+                  AND status = 'completed'
+                GROUP BY user_id
+                ORDER BY total_spent DESC
+                """,
+                "Top spenders in January 2025 (monthly rollup)"
+            ),
+        ]
 
-    # ── Query 4 ──
-    run_query_and_show_results(
-        athena,
-        f"""
-        SELECT user_id,
-               COUNT(*) as total_orders,
-               ROUND(SUM(amount), 2) as total_spent
-        FROM {db}.orders
-        WHERE year = 2025 AND month = 1
-          AND status = 'completed'
-        GROUP BY user_id
-        ORDER BY total_spent DESC
-        """,
-        "Top spenders in January 2025 (completed orders only)"
-    )
+    # Submit all at once: total time is the slowest query, not the sum
+    submitted = [
+        submit_query(executor, query, s3, cache, args.allow_large, args.materialize)
+        for query, _ in queries
+    ]
+    for (query, description), item in zip(queries, submitted):
+        run_query_and_show_results(
+            executor, query, description, s3=s3, cache=cache, submitted=item
+        )
+    executor.shutdown()
 
     print("=" * 60)
     print(" All queries completed!")
@@ -0,0 +1,121 @@
+
+import os
+import re
+import json
+import time
+import hashlib
+
+import pyarrow as pa
+import config
+from s3_utils import list_objects
+
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def normalize_sql(query):
+    """Lowercase, comment- and whitespace-insensitive SQL; literals kept as-is."""
+    query = re.sub(r"--[^\n]*", " ", query)
+    parts = []
+    last = 0
+    for literal in STRING_LITERAL.finditer(query):
+        parts.append(" ".join(query[last:literal.start()].lower().split()))
+        parts.append(literal.group())
+        last = literal.end()
+    parts.append(" ".join(query[last:].lower().split()))
+    return " ".join(part for part in parts if part).strip(" ;")
+
+
+def partition_fingerprint(s3, prefixes):
+    """Hash of every object key and ETag under the prefixes."""
+    digest = hashlib.sha256()
+    for prefix in prefixes:
+        for obj in sorted(list_objects(s3, prefix), key=lambda o: o["Key"]):
+            digest.update(f"{obj['Key']}\0{obj['ETag']}\n".encode())
+    return digest.hexdigest()
+
+
+def query_key(s3, query, prefixes):
+    """Normalized SQL plus a snapshot of the prefixes it reads, hashed.
+
+    prefixes come from query_planner.plan_query().
+    """
+    fingerprint = partition_fingerprint(s3, prefixes)
+    return hashlib.sha256(f"{normalize_sql(query)}\n{fingerprint}".encode()).hexdigest()
+
+
+class QueryCache:
+    """On-disk cache of query results as Arrow IPC files.
+
+    An entry is valid while the partitions it read are unchanged, since
+    any rewrite changes the fingerprint in its key. Reads refresh the
+    entry's mtime, and the least recently used entries are evicted once
+    the store grows past QUERY_CACHE_MAX_MB. With QUERY_CACHE_TTL_SECONDS
+    entries also expire after that many seconds.
+    """
+
+    def __init__(self, directory=None, max_mb=None, ttl_seconds=None):
+        self.directory = directory or config.QUERY_CACHE_DIR
+        self.max_bytes = (max_mb or config.QUERY_CACHE_MAX_MB) * 1024 * 1024
+        self.ttl_seconds = (
+            ttl_seconds if ttl_seconds is not None else config.QUERY_CACHE_TTL_SECONDS
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, s3, query, prefixes):
+        """Cache key: see query_key()."""
+        return query_key(s3, query, prefixes)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return f"{base}.arrow", f"{base}.json"
+
+    def get(self, key):
+        """(table, metadata) for a fresh entry, or None."""
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                metadata = json.load(f)
+            if self.ttl_seconds and time.time() - metadata["created"] > self.ttl_seconds:
+                self.remove(key)
+                return None
+            with pa.memory_map(data_path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (OSError, ValueError, pa.ArrowInvalid):
+            return None
+
+        os.utime(data_path)
+        return table, metadata
+
+    def put(self, key, table, metadata=None):
+        """Store a result; metadata (e.g. query statistics) is kept as JSON."""
+        data_path, meta_path = self._paths(key)
+        temp_path = f"{data_path}.tmp"
+        with pa.OSFile(temp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, data_path)
+
+        with open(meta_path, "w") as f:
+            json.dump({**(metadata or {}), "created": time.time()}, f)
+        self.evict()
+
+    def remove(self, key):
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self):
+        """Drop least recently used entries until the store fits max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".arrow"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".arrow")]))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
@@ -0,0 +1,322 @@
+
+import os
+import re
+import glob
+from datetime import date, datetime, timedelta
+from itertools import product
+
+import config
+from partitions import parse_partition, partition_of
+from query_cache import STRING_LITERAL
+from s3_utils import list_objects
+from upload_datalake import load_upload_manifest
+
+
+TABLE_REFERENCE = re.compile(
+    r"\b(?:from|join)\s+([\w.]+)(?:\s+(?:as\s+)?(\w+))?", re.IGNORECASE
+)
+# EXTRACT(year FROM created_at) is not a table reference
+EXTRACT_FROM = re.compile(r"\bextract\s*\(\s*\w+\s+from\b", re.IGNORECASE)
+NOT_AN_ALIAS = {
+    "where", "join", "inner", "left", "right", "full", "outer", "cross", "on",
+    "using", "group", "order", "having", "limit", "union", "natural",
+}
+WHERE_CLAUSE = re.compile(
+    r"\bwhere\b(?P<where>.*?)(?=\bgroup\s+by\b|\border\s+by\b|\bhaving\b|\blimit\b|$)",
+    re.IGNORECASE | re.DOTALL
+)
+# Column references capture an optional "alias." qualifier
+COLUMN = r"(?<![\w.])(?:(\w+)\.)?(year|month|day)\b"
+EQUALS = re.compile(rf"{COLUMN}\s*=\s*(\d+)", re.IGNORECASE)
+IN_LIST = re.compile(rf"{COLUMN}\s+in\s*\(([\d\s,]+)\)", re.IGNORECASE)
+BETWEEN = re.compile(rf"{COLUMN}\s+between\s+(\d+)\s+and\s+(\d+)", re.IGNORECASE)
+COMPARE = re.compile(rf"{COLUMN}\s*(>=|<=|>|<)\s*(\d+)", re.IGNORECASE)
+CREATED_AT = r"(?<![\w.])(?:(\w+)\.)?created_at"
+TIME_LITERAL = r"(?:timestamp|date)?\s*'(\d{4}-\d{2}-\d{2}[^']*)'"
+CREATED_BETWEEN = re.compile(
+    rf"{CREATED_AT}\s+between\s+{TIME_LITERAL}\s+and\s+{TIME_LITERAL}", re.IGNORECASE
+)
+CREATED_COMPARE = re.compile(rf"{CREATED_AT}\s*(>=|<=|>|<|=)\s*{TIME_LITERAL}", re.IGNORECASE)
+
+# Largest number of prefixes a plan enumerates before falling back to a parent
+MAX_PREFIXES = 100
+
+
+class QueryRejected(Exception):
+    """A query would scan more than QUERY_BYTE_BUDGET_MB."""
+
+
+def partition_domains():
+    """Every value a year/month/day partition column can take."""
+    first_year, last_year = config.ATHENA_PROJECTION_YEARS
+    return {
+        "year": set(range(first_year, last_year + 1)),
+        "month": set(range(1, 13)),
+        "day": set(range(1, 32)),
+    }
+
+
+def and_terms(where):
+    """The WHERE clause with every parenthesized OR group dropped.
+
+    What is left must hold for every row, so predicates found in it can
+    narrow the scan. Returns None if the clause has a top-level OR.
+    """
+    # Literals and IN lists are parked as \x01n\x01 / \x00n\x00 placeholders
+    # while parenthesized groups are flattened
+    literals = STRING_LITERAL.findall(where)
+    text = where
+    for i, literal in enumerate(literals):
+        text = text.replace(literal, f"\x01{i}\x01", 1)
+    in_lists = []
+
+    def flatten(group):
+        inner = group.group(1)
+        if re.fullmatch(r"[\d\s,]+", inner):
+            in_lists.append(inner)
+            return f"\x00{len(in_lists) - 1}\x00"
+        if re.search(r"\bor\b", inner, re.IGNORECASE):
+            return " true "
+        return f" {inner} "
+
+    while True:
+        flattened = re.sub(r"\(([^()]*)\)", flatten, text)
+        if flattened == text:
+            break
+        text = flattened
+
+    if re.search(r"\bor\b", text, re.IGNORECASE):
+        return None
+    text = re.sub(r"\x00(\d+)\x00", lambda m: f"({in_lists[int(m.group(1))]})", text)
+    return re.sub(r"\x01(\d+)\x01", lambda m: literals[int(m.group(1))], text)
+
+
+def table_references(query):
+    """[(table, alias)] for every FROM/JOIN table, alias None if absent."""
+    references = []
+    for name, alias in TABLE_REFERENCE.findall(EXTRACT_FROM.sub("extract(", query)):
+        if alias.lower() in NOT_AN_ALIAS:
+            alias = ""
+        references.append((name.split(".")[-1], alias or None))
+    return references
+
+
+def applies(qualifier, names):
+    """Whether a predicate qualified by qualifier constrains this table.
+
+    names is None for single-table queries, where every predicate does;
+    otherwise only predicates qualified with the table's name or alias
+    count, since an unqualified column in a join can't be attributed.
+    """
+    if names is None:
+        return True
+    return bool(qualifier) and qualifier.lower() in names
+
+
+def partition_constraints(where, names=None):
+    """Allowed values per partition column from the WHERE clause.
+
+    Handles =, IN, BETWEEN and comparisons that must all hold (see
+    and_terms()); anything under an OR is ignored, so the estimate stays
+    an upper bound instead of silently missing partitions. With names
+    (a table's name and alias), only predicates on that table count.
+    """
+    allowed = partition_domains()
+    where = and_terms(where)
+    if where is None:
+        return allowed
+
+    def narrow(qualifier, column, values):
+        if applies(qualifier, names):
+            allowed[column.lower()] &= set(values)
+
+    for qualifier, column, value in EQUALS.findall(where):
+        narrow(qualifier, column, [int(value)])
+    for qualifier, column, values in IN_LIST.findall(where):
+        narrow(qualifier, column, [int(v) for v in values.split(",") if v.strip()])
+    for qualifier, column, low, high in BETWEEN.findall(where):
+        narrow(qualifier, column, range(int(low), int(high) + 1))
+    for qualifier, column, operator, value in COMPARE.findall(where):
+        value = int(value)
+        domain = partition_domains()[column.lower()]
+        narrow(qualifier, column, {
+            ">=": [v for v in domain if v >= value],
+            ">": [v for v in domain if v > value],
+            "<=": [v for v in domain if v <= value],
+            "<": [v for v in domain if v < value],
+        }[operator])
+    return allowed
+
+
+def created_at_range(where, names=None):
+    """(first_day, last_day) implied by created_at predicates, or None."""
+    first = last = None
+    where = and_terms(where) or ""
+    for qualifier, low, high in CREATED_BETWEEN.findall(where):
+        if applies(qualifier, names):
+            first = date.fromisoformat(low[:10])
+            last = date.fromisoformat(high[:10])
+    for qualifier, operator, value in CREATED_COMPARE.findall(where):
+        if not applies(qualifier, names):
+            continue
+        day = date.fromisoformat(value[:10])
+        midnight = datetime.fromisoformat(value.replace(" ", "T")) == datetime.combine(
+            day, datetime.min.time()
+        )
+        if operator in (">=", ">", "="):
+            first = day
+        if operator in ("<=", "="):
+            last = day
+        elif operator == "<":
+            last = day - timedelta(days=1) if midnight else day
+    if first is None or last is None or first > last:
+        return None
+    return first, last
+
+
+def date_range_predicate(first, last, qualifier=None):
+    """Partition predicate selecting exactly the days first..last.
+
+    Columns are prefixed with qualifier (a table alias) when given.
+    """
+    q = f"{qualifier}." if qualifier else ""
+    months = []
+    current = first.replace(day=1)
+    while current <= last:
+        months.append(current)
+        current = (current + timedelta(days=32)).replace(day=1)
+
+    terms = []
+    for month in months:
+        month_end = (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        start_day = first.day if month == months[0] else 1
+        end_day = last.day if month == months[-1] else month_end.day
+        term = f"{q}year = {month.year} AND {q}month = {month.month}"
+        if start_day == end_day:
+            term += f" AND {q}day = {start_day}"
+        elif (start_day, end_day) != (1, month_end.day):
+            term += f" AND {q}day BETWEEN {start_day} AND {end_day}"
+        terms.append(f"({term})")
+    return terms[0] if len(terms) == 1 else f"({' OR '.join(terms)})"
+
+
+def table_files(prefixes, s3=None, local_root=None):
+    """{relative_path: size} of the files under prefixes, from the cheapest source.
+
+    prefixes are relative to the lake root, e.g. "orders/year=2025/month=01/".
+    A local tree if given, else the upload manifest, else an S3 listing;
+    only the given prefixes are globbed, filtered or listed.
+    """
+    if local_root:
+        return {
+            os.path.relpath(path, local_root).replace(os.sep, "/"): os.path.getsize(path)
+            for prefix in prefixes
+            for path in glob.glob(
+                os.path.join(local_root, prefix, "**", "*.parquet"), recursive=True
+            )
+        }
+    manifest = {
+        path: entry["size"]
+        for path, entry in load_upload_manifest().items()
+        if path.startswith(tuple(prefixes))
+    }
+    if manifest or s3 is None:
+        return manifest
+    root = config.DATALAKE_PREFIX
+    return {
+        obj["Key"][len(root) + 1:]: obj["Size"]
+        for prefix in prefixes
+        for obj in list_objects(s3, f"{root}/{prefix}")
+    }
+
+
+def narrowest_prefixes(table, allowed, root):
+    """Directory prefixes covering every allowed partition of a table."""
+    domains = partition_domains()
+    prefixes = [f"{root}/{table}/"]
+    for column in ("year", "month", "day"):
+        if allowed[column] == domains[column]:
+            break
+        expanded = [
+            f"{prefix}{column}={value if column == 'year' else f'{value:02d}'}/"
+            for prefix, value in product(prefixes, sorted(allowed[column]))
+        ]
+        if len(expanded) > MAX_PREFIXES:
+            break
+        prefixes = expanded
+    return prefixes
+
+
+def plan_query(query, s3=None, local_root=None):
+    """Work out which partitions a query reads and how many bytes that is.
+
+    created_at ranges on a table without year/month/day filters are
+    rewritten into the matching partition predicate first. In a join,
+    only predicates qualified with a table's alias narrow that table;
+    the rest of the tables are planned as full scans. Returns a dict
+    with the (possibly rewritten) query, whether it was rewritten, the
+    tables, the matched partitions, S3 (or local) prefixes covering them
+    and the estimated bytes.
+    """
+    match = WHERE_CLAUSE.search(query)
+    where = match.group("where") if match else ""
+    references = table_references(query)
+    single = len(references) == 1
+
+    scans = []
+    predicates = []
+    for table, alias in references:
+        names = None if single else {table.lower(), (alias or table).lower()}
+        allowed = partition_constraints(where, names)
+        created_dates = None
+        days = created_at_range(where, names) if allowed == partition_domains() else None
+        if days:
+            qualifier = None if single else alias or table
+            predicates.append(date_range_predicate(*days, qualifier))
+            created_dates = {
+                days[0] + timedelta(days=i) for i in range((days[1] - days[0]).days + 1)
+            }
+            allowed["year"] = {d.year for d in created_dates}
+            allowed["month"] = {d.month for d in created_dates}
+            allowed["day"] = {d.day for d in created_dates}
+        scans.append((table, allowed, created_dates))
+
+    if predicates:
+        query = (
+            query[:match.start("where")] + f" {' AND '.join(predicates)} AND ("
+            + where.strip() + ") " + query[match.end("where"):]
+        )
+
+    def selected(values, allowed, created_dates):
+        if created_dates and "day" in values:
+            return date(values["year"], values["month"], values["day"]) in created_dates
+        return all(values[key] in allowed[key] for key in ("year", "month", "day") if key in values)
+
+    plan = {"query": query, "rewritten": bool(predicates),
+            "tables": sorted({table for table, _ in references}),
+            "partitions": set(), "prefixes": [], "bytes": 0}
+
+    root = local_root or config.DATALAKE_PREFIX
+    for table, allowed, created_dates in scans:
+        prefixes = narrowest_prefixes(table, allowed, root)
+        for prefix in prefixes:
+            if prefix not in plan["prefixes"]:
+                plan["prefixes"].append(prefix)
+        relative = [prefix[len(root) + 1:] for prefix in prefixes]
+        for path, size in table_files(relative, s3, local_root).items():
+            partition = partition_of(path)
+            if partition and selected(parse_partition(partition), allowed, created_dates):
+                plan["partitions"].add(partition)
+                plan["bytes"] += size
+    return plan
+
+
+def check_budget(plan, allow_large=False):
+    """Raise QueryRejected if the plan is over QUERY_BYTE_BUDGET_MB."""
+    budget = config.QUERY_BYTE_BUDGET_MB * 1024 * 1024
+    if plan["bytes"] > budget and not allow_large:
+        raise QueryRejected(
+            f"would scan ~{plan['bytes']:,} bytes in {len(plan['partitions'])} "
+            f"partition(s), over the {config.QUERY_BYTE_BUDGET_MB} MB budget; "
+            f"add year/month/day filters or allow large scans"
+        )
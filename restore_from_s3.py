@@ -0,0 +1,247 @@
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+import config
+from backup_to_s3 import pg_env
+from chunk_store import MANIFEST_SUFFIX, iter_manifest_data, load_manifest
+from compression import codec_for_key, get_decompressor
+from retention import list_backup_sets
+from s3_utils import iter_ranged_get
+
+
+def find_backup(s3, name=None):
+    """Return the newest backup, or the one whose id/key contains `name`.
+
+    Directory backups without toc.dat are incomplete and never chosen.
+    """
+    backups = list_backup_sets(s3)
+    if name:
+        backups = [
+            b for b in backups
+            if name in b["backup"] or any(name == key for key in b["objects"])
+        ]
+    return backups[-1] if backups else None
+
+
+def connection_args(dbname):
+    """Host/port/user/database flags shared by psql and pg_restore."""
+    return [
+        "-h", config.DB_HOST,
+        "-p", str(config.DB_PORT),
+        "-U", config.DB_USER,
+        "-d", dbname,
+    ]
+
+
+def ensure_database(dbname):
+    """Create the target database if it doesn't exist yet."""
+    conn = psycopg2.connect(
+        host=config.DB_HOST,
+        port=config.DB_PORT,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        dbname="postgres"
+    )
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+    if not cursor.fetchone():
+        cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
+        print(f"  Database '{dbname}' created")
+
+    cursor.close()
+    conn.close()
+
+
+def feed_psql(chunks, target_db):
+    """Pipe an iterator of plain-SQL bytes into psql; returns bytes written.
+
+    psql runs the whole script as one transaction (-1), and is killed if
+    reading the chunks fails, so a broken download never leaves a
+    half-restored database behind.
+    """
+    # stderr goes to a temp file so psql can never block on a full pipe
+    stderr_file = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        ["psql", *connection_args(target_db), "-q", "-1", "-v", "ON_ERROR_STOP=1"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=stderr_file,
+        env=pg_env()
+    )
+
+    written = 0
+    try:
+        for data in chunks:
+            if data:
+                proc.stdin.write(data)
+                written += len(data)
+    except BrokenPipeError:
+        pass  # psql stopped on an error; its stderr explains why
+    except BaseException:
+        # Kill psql before its stdin closes, so it can't commit a partial restore
+        proc.kill()
+        proc.wait()
+        stderr_file.close()
+        raise
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    proc.wait()
+    stderr_file.seek(0)
+    error = stderr_file.read().decode(errors="replace")
+    stderr_file.close()
+    if proc.returncode != 0:
+        raise RuntimeError(f"psql failed: {error.strip()}")
+    return written
+
+
+def restore_compressed_dump(s3, key, target_db):
+    """Download a .sql.gz/.sql.zst with parallel ranged GETs into psql."""
+    size = s3.head_object(Bucket=config.BUCKET_NAME, Key=key)["ContentLength"]
+    decompressor = get_decompressor(codec_for_key(key))
+    print(f"  Streaming {size:,} bytes with ranged GETs "
+          f"({config.RESTORE_DOWNLOAD_WORKERS} workers)...")
+
+    parts = iter_ranged_get(
+        s3, key, size,
+        part_size=config.RESTORE_RANGE_MB * 1024 * 1024,
+        workers=config.RESTORE_DOWNLOAD_WORKERS
+    )
+    return feed_psql(
+        (decompressor.decompress(part) for part in parts), target_db
+    )
+
+
+def restore_incremental(s3, key, target_db):
+    """Rebuild a chunked (incremental) backup straight into psql."""
+    manifest = load_manifest(s3, key)
+    print(f"  Streaming {len(manifest['chunks']):,} chunk(s), "
+          f"{manifest['raw_size']:,} bytes...")
+    return feed_psql(
+        iter_manifest_data(s3, manifest, workers=config.RESTORE_DOWNLOAD_WORKERS),
+        target_db
+    )
+
+
+def restore_directory(s3, backup, target_db):
+    """Download a directory-format dump in parallel, then pg_restore -j."""
+    restore_dir = tempfile.mkdtemp(prefix="pg_restore_")
+    print(f"  Downloading {len(backup['objects'])} file(s) "
+          f"({config.RESTORE_DOWNLOAD_WORKERS} workers)...")
+
+    def download(key):
+        s3.download_file(
+            Bucket=config.BUCKET_NAME,
+            Key=key,
+            Filename=os.path.join(restore_dir, os.path.basename(key))
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.RESTORE_DOWNLOAD_WORKERS) as pool:
+            list(pool.map(download, backup["objects"]))
+
+        print(f"  Running pg_restore -j {config.RESTORE_JOBS}...")
+        result = subprocess.run(
+            [
+                "pg_restore",
+                *connection_args(target_db),
+                "-j", str(config.RESTORE_JOBS),
+                "--no-owner",
+                "--no-privileges",
+                restore_dir
+            ],
+            capture_output=True,
+            text=True,
+            env=pg_env()
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"pg_restore failed: {result.stderr.strip()}")
+    finally:
+        shutil.rmtree(restore_dir, ignore_errors=True)
+
+    return backup["bytes"]
+
+
+def restore_backup(s3, backup, target_db):
+    """Restore any backup format into target_db; returns bytes processed."""
+    keys = backup["objects"]
+
+    if any(key.startswith(f"{backup['backup']}/") for key in keys):
+        if not any(key.endswith("/toc.dat") for key in keys):
+            raise ValueError(
+                f"{backup['backup']} is an incomplete directory backup (no toc.dat)"
+            )
+        return restore_directory(s3, backup, target_db)
+    elif keys[0].endswith(MANIFEST_SUFFIX):
+        return restore_incremental(s3, keys[0], target_db)
+    elif codec_for_key(keys[0]):
+        return restore_compressed_dump(s3, keys[0], target_db)
+
+    raise ValueError(f"Don't know how to restore {backup['backup']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore a backup from S3")
+    parser.add_argument(
+        "--backup",
+        help="backup id or key to restore (default: newest backup)"
+    )
+    parser.add_argument(
+        "--target-db", default=config.RESTORE_DB_NAME,
+        help=f"database to restore into (default: {config.RESTORE_DB_NAME})"
+    )
+    args = parser.parse_args()
+
+    print("=" * 55)
+    print("  PostgreSQL Restore from S3")
+    print("=" * 55)
+    print()
+
+    s3 = boto3.client("s3", region_name=config.REGION)
+
+    print("[1/3] Finding backup...")
+    backup = find_backup(s3, args.backup)
+    if not backup:
+        print("  ✗ No matching backup found")
+        exit(1)
+    print(f"  ✓ {backup['backup']} ({backup['bytes']:,} bytes)")
+
+    print(f"\n[2/3] Preparing database '{args.target_db}'...")
+    ensure_database(args.target_db)
+
+    print("\n[3/3] Restoring...")
+    started = time.monotonic()
+    try:
+        size = restore_backup(s3, backup, args.target_db)
+    except Exception as e:
+        print(f"  ✗ Restore failed: {e}")
+        exit(1)
+    elapsed = time.monotonic() - started
+
+    mb_per_sec = size / (1024 * 1024) / elapsed if elapsed > 0 else 0
+    print(f"  ✓ Restored {size:,} bytes in {elapsed:.1f}s ({mb_per_sec:.1f} MB/s)")
+
+    print()
+    print("=" * 55)
+    print("  RESTORE COMPLETE!")
+    print(f"   {backup['backup']} → {args.target_db}")
+    print("=" * 55)
+
+
+if __name__ == "__main__":
+    main()
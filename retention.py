@@ -0,0 +1,175 @@
+
+import re
+import json
+from datetime import datetime, timedelta
+
+import boto3
+import config
+from s3_utils import delete_keys, list_objects
+
+
+# backups/postgres/2025/01/10/backup_20250110_143022.sql.gz
+# backups/postgres/2025/01/10/backup_20250110_143022/toc.dat
+# backups/postgres/2025/01/10/backup_20250110_143022.manifest.json
+BACKUP_NAME = re.compile(r"^(.*/backup_(\d{8}_\d{6}))")
+
+
+def list_backup_sets(s3, include_incomplete=False):
+    """Group every backup object into backups, oldest first.
+
+    One paginated listing is enough: keys sort by date folder and the
+    timestamp in the file name. A directory-format backup is many objects
+    that share one backup id, and is only complete once its toc.dat has
+    been uploaded; incomplete ones (still uploading, or a failed run) are
+    left out unless include_incomplete. The chunk store is not a backup
+    and is skipped.
+    """
+    backups = {}
+    for obj in list_objects(s3, f"{config.BACKUP_PREFIX}/"):
+        if obj["Key"].startswith(f"{config.BACKUP_CHUNK_PREFIX}/"):
+            continue
+        match = BACKUP_NAME.match(obj["Key"])
+        if not match:
+            continue
+
+        backup_id, stamp = match.groups()
+        backup = backups.setdefault(backup_id, {
+            "backup": backup_id,
+            "timestamp": datetime.strptime(stamp, "%Y%m%d_%H%M%S"),
+            "objects": [],
+            "bytes": 0,
+        })
+        backup["objects"].append(obj["Key"])
+        backup["bytes"] += obj["Size"]
+
+    for backup in backups.values():
+        directory = any(key.startswith(f"{backup['backup']}/") for key in backup["objects"])
+        backup["complete"] = not directory or any(
+            key.endswith("/toc.dat") for key in backup["objects"]
+        )
+    return sorted(
+        (b for b in backups.values() if b["complete"] or include_incomplete),
+        key=lambda b: b["timestamp"]
+    )
+
+
+def plan_retention(backups, now=None):
+    """Decide which backups to keep with a grandfather-father-son policy.
+
+    Keeps every backup from the last GFS_KEEP_ALL_HOURS, then the newest
+    backup of each day for GFS_DAILY_DAYS, of each ISO week for
+    GFS_WEEKLY_WEEKS and of each month for GFS_MONTHLY_MONTHS. The
+    decision is made in a single newest-first pass: a backup is kept if
+    it is the first one seen in a bucket whose window it falls into.
+    Incomplete directory backups never fill a bucket; they are kept
+    while they may still be uploading (GFS_KEEP_ALL_HOURS) and deleted
+    after that.
+    """
+    now = now or datetime.now()
+    keep_all = now - timedelta(hours=config.GFS_KEEP_ALL_HOURS)
+    daily = now - timedelta(days=config.GFS_DAILY_DAYS)
+    weekly = now - timedelta(weeks=config.GFS_WEEKLY_WEEKS)
+
+    seen_days = set()
+    seen_weeks = set()
+    seen_months = set()
+    keep = []
+    delete = []
+
+    for backup in sorted(backups, key=lambda b: b["timestamp"], reverse=True):
+        ts = backup["timestamp"]
+        day = ts.date()
+        week = ts.isocalendar()[:2]
+        month = (ts.year, ts.month)
+        months_old = (now.year - ts.year) * 12 + now.month - ts.month
+
+        entry = {
+            "backup": backup["backup"],
+            "timestamp": ts.isoformat(),
+            "objects": len(backup["objects"]),
+            "bytes": backup["bytes"],
+        }
+        if not backup.get("complete", True):
+            if ts >= keep_all:
+                keep.append({**entry, "reasons": ["incomplete"]})
+            else:
+                delete.append({**entry, "incomplete": True})
+            continue
+
+        reasons = []
+        if ts >= keep_all:
+            reasons.append("hourly")
+        if ts >= daily and day not in seen_days:
+            reasons.append("daily")
+        if ts >= weekly and week not in seen_weeks:
+            reasons.append("weekly")
+        if months_old < config.GFS_MONTHLY_MONTHS and month not in seen_months:
+            reasons.append("monthly")
+
+        if reasons:
+            seen_days.add(day)
+            seen_weeks.add(week)
+            seen_months.add(month)
+            keep.append({**entry, "reasons": reasons})
+        else:
+            delete.append(entry)
+
+    return {
+        "generated_at": now.isoformat(),
+        "policy": {
+            "keep_all_hours": config.GFS_KEEP_ALL_HOURS,
+            "daily_days": config.GFS_DAILY_DAYS,
+            "weekly_weeks": config.GFS_WEEKLY_WEEKS,
+            "monthly_months": config.GFS_MONTHLY_MONTHS,
+        },
+        "keep": keep,
+        "delete": delete,
+        "summary": {
+            "kept": len(keep),
+            "deleted": len(delete),
+            "bytes_freed": sum(entry["bytes"] for entry in delete),
+        },
+    }
+
+
+def apply_gfs_retention(dry_run=None):
+    """Apply the grandfather-father-son policy and write its plan as JSON."""
+    if dry_run is None:
+        dry_run = config.RETENTION_DRY_RUN
+    print("\n[4/5] Applying GFS retention policy "
+          f"({config.GFS_KEEP_ALL_HOURS}h all / {config.GFS_DAILY_DAYS}d daily / "
+          f"{config.GFS_WEEKLY_WEEKS}w weekly / {config.GFS_MONTHLY_MONTHS}m monthly)...")
+
+    s3 = boto3.client("s3", region_name=config.REGION)
+    backups = list_backup_sets(s3, include_incomplete=True)
+    plan = plan_retention(backups)
+
+    with open(config.RETENTION_PLAN_FILE, "w") as f:
+        json.dump(plan, f, indent=2)
+
+    summary = plan["summary"]
+    print(f"  {len(backups)} backup(s): keep {summary['kept']}, "
+          f"delete {summary['deleted']} ({summary['bytes_freed']:,} bytes)")
+    print(f"  Plan written to {config.RETENTION_PLAN_FILE}")
+
+    if not plan["delete"]:
+        print("  No expired backups found")
+        return plan
+    if dry_run:
+        print("  [dry run] Nothing deleted")
+        return plan
+
+    # Map ids back to their objects (directory backups have many)
+    objects = {backup["backup"]: backup["objects"] for backup in backups}
+    keys = [key for entry in plan["delete"] for key in objects[entry["backup"]]]
+    deleted = delete_keys(s3, keys, workers=config.RETENTION_DELETE_WORKERS)
+    print(f"  Deleted {summary['deleted']} backup(s), {deleted} object(s)")
+    return plan
+
+
+if __name__ == "__main__":
+    # Print the plan for the current bucket without deleting anything
+    s3 = boto3.client("s3", region_name=config.REGION)
+    print(json.dumps(
+        plan_retention(list_backup_sets(s3, include_incomplete=True)), indent=2
+    ))
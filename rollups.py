@@ -0,0 +1,183 @@
+
+import os
+import glob
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import config
+from parquet_writer import PartitionWriter
+from partitions import parse_partition, read_partitions_file
+
+
+OUTPUT_DIR = "output"
+
+# Daily rollups: name → source table, group keys, {measure: (column, aggregation)}
+DAILY_ROLLUPS = {
+    "daily_orders_by_status": {
+        "source": "orders",
+        "keys": ["status"],
+        "measures": {"order_count": ("order_id", "count"), "revenue": ("amount", "sum")},
+    },
+    "daily_orders_by_user": {
+        "source": "orders",
+        "keys": ["user_id", "status"],
+        "measures": {"order_count": ("order_id", "count"), "revenue": ("amount", "sum")},
+    },
+    "daily_events_by_type": {
+        "source": "events",
+        "keys": ["event_type"],
+        "measures": {"event_count": ("event_id", "count")},
+    },
+}
+
+# Monthly rollups are re-aggregated from the daily ones, never from raw data
+MONTHLY_ROLLUPS = {
+    "monthly_orders_by_status": "daily_orders_by_status",
+    "monthly_orders_by_user": "daily_orders_by_user",
+    "monthly_events_by_type": "daily_events_by_type",
+}
+
+# Athena column definitions, shared by the daily and monthly variant
+ROLLUP_COLUMNS = {
+    "daily_orders_by_status": "status STRING, order_count BIGINT, revenue DOUBLE",
+    "daily_orders_by_user": "user_id BIGINT, status STRING, order_count BIGINT, revenue DOUBLE",
+    "daily_events_by_type": "event_type STRING, event_count BIGINT",
+}
+
+
+def rollup_partition(name, year, month, day=None):
+    """Relative partition path of a daily (with day) or monthly rollup."""
+    path = f"{name}/year={year}/month={month:02d}"
+    return f"{path}/day={day:02d}" if day is not None else path
+
+
+def read_parquet_files(directory, columns=None):
+    """Concatenate the Parquet files below a partition directory, or None."""
+    paths = sorted(glob.glob(os.path.join(directory, "**", "*.parquet"), recursive=True))
+    if not paths:
+        return None
+    return pa.concat_tables([pq.read_table(path, columns=columns) for path in paths])
+
+
+def write_rollup(partition, table):
+    """Replace one rollup partition's files with `table`."""
+    with PartitionWriter(os.path.join(OUTPUT_DIR, *partition.split("/"))) as writer:
+        writer.write(table)
+    return partition
+
+
+def aggregate(table, keys, measures):
+    """Group by keys; measures maps output name → (column, aggregation)."""
+    grouped = table.group_by(keys).aggregate(list(measures.values()))
+    columns = {key: grouped.column(key) for key in keys}
+    for name, (column, function) in measures.items():
+        columns[name] = grouped.column(f"{column}_{function}")
+    return pa.table(columns).sort_by([(key, "ascending") for key in keys])
+
+
+def build_daily(name, year, month, day):
+    """Recompute one daily rollup partition from its raw partition."""
+    spec = DAILY_ROLLUPS[name]
+    source = os.path.join(
+        OUTPUT_DIR, spec["source"], f"year={year}", f"month={month:02d}", f"day={day:02d}"
+    )
+    columns = spec["keys"] + sorted({column for column, _ in spec["measures"].values()})
+    raw = read_parquet_files(source, columns=columns)
+    if raw is None:
+        return None
+    return write_rollup(
+        rollup_partition(name, year, month, day),
+        aggregate(raw, spec["keys"], spec["measures"])
+    )
+
+
+def build_monthly(name, year, month):
+    """Recompute one monthly rollup by summing its daily rollup partitions."""
+    daily_name = MONTHLY_ROLLUPS[name]
+    daily = read_parquet_files(
+        os.path.join(OUTPUT_DIR, *rollup_partition(daily_name, year, month).split("/"))
+    )
+    if daily is None:
+        return None
+    keys = DAILY_ROLLUPS[daily_name]["keys"]
+    measures = {
+        measure: (measure, "sum") for measure in DAILY_ROLLUPS[daily_name]["measures"]
+    }
+    return write_rollup(rollup_partition(name, year, month), aggregate(daily, keys, measures))
+
+
+def update_rollups(partitions, workers=None):
+    """Rebuild the rollups affected by the given raw partitions.
+
+    Each daily rollup partition is recomputed from scratch and replaces
+    the previous files, then every touched month is re-summed from its
+    daily rollups, so re-running for the same partitions never double
+    counts. Returns the rollup partitions written.
+    """
+    daily_tasks = set()
+    for partition in partitions:
+        values = parse_partition(partition)
+        if "day" not in values:
+            continue
+        for name, spec in DAILY_ROLLUPS.items():
+            if spec["source"] == values["table"]:
+                daily_tasks.add((name, values["year"], values["month"], values["day"]))
+
+    monthly_tasks = {
+        (monthly, year, month)
+        for monthly, daily in MONTHLY_ROLLUPS.items()
+        for name, year, month, _ in daily_tasks
+        if name == daily
+    }
+
+    with ThreadPoolExecutor(max_workers=workers or config.ROLLUP_WORKERS) as pool:
+        written = list(pool.map(lambda task: build_daily(*task), sorted(daily_tasks)))
+        written += pool.map(lambda task: build_monthly(*task), sorted(monthly_tasks))
+    return [partition for partition in written if partition]
+
+
+def raw_partitions():
+    """Every day partition of the raw tables in output/."""
+    found = []
+    for table in {spec["source"] for spec in DAILY_ROLLUPS.values()}:
+        pattern = os.path.join(OUTPUT_DIR, table, "year=*", "month=*", "day=*")
+        for directory in glob.glob(pattern):
+            found.append(os.path.relpath(directory, OUTPUT_DIR).replace(os.sep, "/"))
+    return sorted(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild daily and monthly rollups")
+    parser.add_argument(
+        "--partitions", default=config.TOUCHED_PARTITIONS_FILE, metavar="FILE",
+        help=f"raw partitions to roll up (default: {config.TOUCHED_PARTITIONS_FILE})"
+    )
+    parser.add_argument(
+        "--all", action="store_true",
+        help="rebuild rollups for every partition in output/"
+    )
+    args = parser.parse_args()
+
+    print("=" * 55)
+    print("  Building Rollups")
+    print("=" * 55)
+    print()
+
+    partitions = raw_partitions() if args.all else read_partitions_file(args.partitions)
+    started = time.monotonic()
+    written = update_rollups(partitions)
+
+    for partition in written:
+        print(f"  ✓ {partition}")
+    print()
+    print("=" * 55)
+    print(f"  {len(written)} rollup partition(s) from {len(partitions)} raw "
+          f"partition(s) in {time.monotonic() - started:.1f}s")
+    print("=" * 55)
+
+
+if __name__ == "__main__":
+    main()
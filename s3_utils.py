@@ -0,0 +1,88 @@
+
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+# DeleteObjects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+
+def list_common_prefixes(s3, prefix):
+    """Return the immediate "sub-folders" under a prefix (Delimiter listing)."""
+    prefixes = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=config.BUCKET_NAME,
+        Prefix=prefix,
+        Delimiter="/"
+    ):
+        for common in page.get("CommonPrefixes", []):
+            prefixes.append(common["Prefix"])
+    return prefixes
+
+
+def list_objects(s3, prefix):
+    """Return every object (Key, Size, LastModified, ETag) under a prefix."""
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=config.BUCKET_NAME, Prefix=prefix):
+        objects.extend(page.get("Contents", []))
+    return objects
+
+
+def iter_ranged_get(s3, key, size, part_size=16 * 1024 * 1024, workers=8):
+    """Yield an object's bytes in order, fetched as parallel ranged GETs.
+
+    Up to workers * 2 ranges are in flight at once, so memory stays
+    bounded while the download runs ahead of the consumer.
+    """
+    ranges = [
+        (start, min(start + part_size, size) - 1)
+        for start in range(0, size, part_size)
+    ]
+
+    def fetch(byte_range):
+        response = s3.get_object(
+            Bucket=config.BUCKET_NAME,
+            Key=key,
+            Range=f"bytes={byte_range[0]}-{byte_range[1]}"
+        )
+        return response["Body"].read()
+
+    window = workers * 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(fetch, r) for r in ranges[:window]]
+        for i in range(len(ranges)):
+            data = pending[i].result()
+            pending[i] = None
+            if i + window < len(ranges):
+                pending.append(pool.submit(fetch, ranges[i + window]))
+            yield data
+
+
+def delete_keys(s3, keys, workers=8):
+    """Delete keys in 1000-key DeleteObjects batches spread over a thread pool.
+
+    Returns the number of keys S3 reported as deleted.
+    """
+    keys = list(keys)
+    batches = [
+        keys[i:i + DELETE_BATCH_SIZE]
+        for i in range(0, len(keys), DELETE_BATCH_SIZE)
+    ]
+
+    def delete_batch(batch):
+        response = s3.delete_objects(
+            Bucket=config.BUCKET_NAME,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+        )
+        errors = response.get("Errors", [])
+        for error in errors:
+            print(f"  Warning: could not delete {error['Key']}: {error['Message']}")
+        return len(batch) - len(errors)
+
+    if not batches:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        return sum(pool.map(delete_batch, batches))
@@ -1,63 +1,217 @@
 
-import time
-import boto3
+import argparse
+
 import config
+from athena_executor import AthenaExecutor
+from partitions import parse_partition, partition_of, read_partitions_file
+from rollups import DAILY_ROLLUPS, MONTHLY_ROLLUPS, ROLLUP_COLUMNS
+from upload_datalake import load_upload_manifest
+
+
+def report_execution(execution):
+    """Print the outcome of a finished query; returns its id or None."""
+    execution_id = execution["QueryExecutionId"]
+    status = execution["Status"]
+    print(f"    Execution ID: {execution_id}")
+
+    if status["State"] == "SUCCEEDED":
+        print(f"    ✓ SUCCEEDED")
+        return execution_id
+
+    elif status["State"] == "FAILED":
+        print(f"    ✗ FAILED: {status.get('StateChangeReason', 'Unknown')}")
+        return None
 
+    print(f"    ✗ {status['State']}")
+    return None
 
-def run_athena_query(athena_client, query, description):
+
+def run_athena_query(executor, query, description):
     """Run a query in Athena and wait for it to finish."""
     print(f"  Running: {description}...")
+    return report_execution(executor.execute(query))
+
+
+def projection_properties(table_location, daily=True):
+    """TBLPROPERTIES enabling partition projection, or "" when it's off.
+
+    Athena then derives partitions from the year/month/day ranges and
+    the location template, so no partition metadata is ever stored and
+    MSCK REPAIR TABLE is never needed.
+    """
+    if not config.ATHENA_PARTITION_PROJECTION:
+        return ""
+
+    first_year, last_year = config.ATHENA_PROJECTION_YEARS
+    template = f"{table_location}year=${{year}}/month=${{month}}/"
+    day_properties = ""
+    if daily:
+        template += "day=${day}/"
+        day_properties = """
+            'projection.day.type' = 'integer',
+            'projection.day.range' = '1,31',
+            'projection.day.digits' = '2',"""
+    return f"""
+        TBLPROPERTIES (
+            'projection.enabled' = 'true',
+            'projection.year.type' = 'integer',
+            'projection.year.range' = '{first_year},{last_year}',
+            'projection.month.type' = 'integer',
+            'projection.month.range' = '1,12',
+            'projection.month.digits' = '2',{day_properties}
+            'storage.location.template' = '{template}'
+        )"""
+
+
+def rollup_table_ddl(name, columns, daily):
+    """CREATE EXTERNAL TABLE for a daily or monthly rollup table."""
+    location = f"s3://{config.BUCKET_NAME}/{config.DATALAKE_PREFIX}/{name}/"
+    partition_columns = "year INT, month INT, day INT" if daily else "year INT, month INT"
+    return f"""
+        CREATE EXTERNAL TABLE IF NOT EXISTS {config.ATHENA_DATABASE}.{name} (
+            {columns}
+        )
+        PARTITIONED BY ({partition_columns})
+        STORED AS PARQUET
+        LOCATION '{location}'
+        {projection_properties(location, daily=daily)}
+        """
+
+
+def partitions_from_manifest():
+    """Every partition that has a file in the local upload manifest."""
+    return sorted({
+        partition
+        for partition in map(partition_of, load_upload_manifest())
+        if partition
+    })
+
+
+def add_partition_statements(table, partitions):
+    """ALTER TABLE ... ADD IF NOT EXISTS statements, many partitions each."""
+    db = config.ATHENA_DATABASE
+    location = f"s3://{config.BUCKET_NAME}/{config.DATALAKE_PREFIX}"
+    specs = []
+    for partition in sorted(set(partitions)):
+        values = parse_partition(partition)
+        if values["table"] != table or "month" not in values:
+            continue
+        spec = ", ".join(
+            f"{key}={values[key]}" for key in ("year", "month", "day") if key in values
+        )
+        specs.append(f"PARTITION ({spec}) LOCATION '{location}/{partition}/'")
+
+    batch = config.ATHENA_PARTITION_BATCH
+    return [
+        f"ALTER TABLE {db}.{table} ADD IF NOT EXISTS\n    "
+        + "\n    ".join(specs[i:i + batch])
+        for i in range(0, len(specs), batch)
+    ]
 
-    # Start the query
-    response = athena_client.start_query_execution(
-        QueryString=query,
-        ResultConfiguration={
-            "OutputLocation": f"s3://{config.BUCKET_NAME}/athena-results/"
-        }
+
+def register_partitions(executor, table, partitions):
+    """Register only the given partitions; returns the number registered.
+
+    All statements are submitted at once and the executor runs up to
+    ATHENA_MAX_CONCURRENCY of them concurrently, so the cost follows the
+    amount of new data rather than the size of the table prefix that
+    MSCK REPAIR TABLE would list.
+    """
+    statements = add_partition_statements(table, partitions)
+    if not statements:
+        print(f"  No new {table} partitions to register")
+        return 0
+
+    futures = [executor.submit(statement) for statement in statements]
+    results = []
+    for number, future in enumerate(futures, 1):
+        print(f"  Adding {table} partitions (batch {number}/{len(statements)})...")
+        results.append(report_execution(future.result()))
+
+    registered = sum(
+        statement.count("PARTITION (")
+        for statement, result in zip(statements, results)
+        if result
     )
+    print(f"  ✓ {registered} {table} partition(s) registered "
+          f"in {len(statements)} statement(s)")
+    return registered
 
-    execution_id = response["QueryExecutionId"]
-    print(f"    Execution ID: {execution_id}")
 
-    # Wait for query to complete
-    while True:
-        result = athena_client.get_query_execution(
-            QueryExecutionId=execution_id
+def load_partitions(executor, table, partitions):
+    """Bring the table's partition metadata up to date (step 4/5)."""
+    if config.ATHENA_PARTITION_PROJECTION:
+        print("  ✓ Partition projection enabled, nothing to load")
+    elif partitions is not None:
+        register_partitions(executor, table, partitions)
+    else:
+        run_athena_query(
+            executor,
+            f"MSCK REPAIR TABLE {config.ATHENA_DATABASE}.{table};",
+            f"Scanning S3 for {table} partitions"
         )
-        state = result["QueryExecution"]["Status"]["State"]
 
-        if state == "SUCCEEDED":
-            print(f"    ✓ SUCCEEDED")
-            return execution_id
 
-        elif state == "FAILED":
-            reason = result["QueryExecution"]["Status"].get(
-                "StateChangeReason", "Unknown"
-            )
-            print(f"    ✗ FAILED: {reason}")
-            return None
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create the Athena tables")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--partitions", nargs="?", const=config.TOUCHED_PARTITIONS_FILE,
+        metavar="FILE",
+        help="register only the partitions listed in FILE "
+             f"(default: {config.TOUCHED_PARTITIONS_FILE})"
+    )
+    source.add_argument(
+        "--from-manifest", action="store_true",
+        help="register every partition in the upload manifest"
+    )
+    parser.add_argument(
+        "--recreate", action="store_true",
+        help="drop and re-create the tables, e.g. after a schema change "
+             "(external tables: the data in S3 is not touched)"
+    )
+    return parser.parse_args()
 
-        elif state == "CANCELLED":
-            print(f"    ✗ CANCELLED")
-            return None
 
-        # Still running, wait a bit
-        time.sleep(2)
+def drop_table(executor, table):
+    """DROP an external table; its files in S3 are left as they are."""
+    run_athena_query(
+        executor,
+        f"DROP TABLE IF EXISTS {config.ATHENA_DATABASE}.{table};",
+        f"Dropping {table} table"
+    )
 
 
 def main():
+    args = parse_args()
+
     print("=" * 55)
     print("  Setting Up Athena Tables")
     print("=" * 55)
     print()
 
-    athena = boto3.client("athena", region_name=config.REGION)
+    athena = AthenaExecutor()
     db = config.ATHENA_DATABASE
     bucket = config.BUCKET_NAME
     prefix = config.DATALAKE_PREFIX
 
+    partitions = None
+    if args.partitions:
+        partitions = read_partitions_file(args.partitions)
+        print(f"{len(partitions)} partition(s) listed in {args.partitions}")
+        print()
+    elif args.from_manifest:
+        partitions = partitions_from_manifest()
+        print(f"{len(partitions)} partition(s) in {config.UPLOAD_MANIFEST_FILE}")
+        print()
+    if args.recreate and args.partitions:
+        # A re-created table knows no partitions, not just the touched ones
+        partitions = None
+        print("--recreate: registering every partition, not just the listed ones")
+        print()
+
     # ── Step 1: Create database ──
-    print("[1/5] Create database")
+    print("[1/6] Create database")
     run_athena_query(
         athena,
         f"CREATE DATABASE IF NOT EXISTS {db};",
@@ -66,69 +220,90 @@ def main():
     print()
 
     # ── Step 2: Create orders table ──
-    print("[2/5] Create orders table")
+    print("[2/6] Create orders table")
+    if args.recreate:
+        drop_table(athena, "orders")
     run_athena_query(
         athena,
         f"""
         CREATE EXTERNAL TABLE IF NOT EXISTS {db}.orders (
             order_id STRING,
-            user_id INT,
+            user_id BIGINT,
             amount DOUBLE,
             currency STRING,
             status STRING,
-            created_at STRING
+            created_at TIMESTAMP
         )
         PARTITIONED BY (year INT, month INT, day INT)
         STORED AS PARQUET
         LOCATION 's3://{bucket}/{prefix}/orders/'
+        {projection_properties(f"s3://{bucket}/{prefix}/orders/")}
         """,
         "Creating orders table"
     )
     print()
 
     # ── Step 3: Create events table ──
-    print("[3/5] Create events table")
+    print("[3/6] Create events table")
+    if args.recreate:
+        drop_table(athena, "events")
     run_athena_query(
         athena,
         f"""
         CREATE EXTERNAL TABLE IF NOT EXISTS {db}.events (
             event_id STRING,
-            user_id INT,
+            user_id BIGINT,
             user_email STRING,
             event_type STRING,
-            properties STRING,
-            created_at STRING
+            device STRING,
+            properties MAP<STRING, STRING>,
+            created_at TIMESTAMP
         )
         PARTITIONED BY (year INT, month INT, day INT)
         STORED AS PARQUET
         LOCATION 's3://{bucket}/{prefix}/events/'
+        {projection_properties(f"s3://{bucket}/{prefix}/events/")}
         """,
         "Creating events table"
     )
     print()
 
     # ── Step 4: Load order partitions ──
-    print("[4/5] Load order partitions")
-    run_athena_query(
-        athena,
-        f"MSCK REPAIR TABLE {db}.orders;",
-        "Scanning S3 for order partitions"
-    )
+    print("[4/6] Load order partitions")
+    load_partitions(athena, "orders", partitions)
     print()
 
     # ── Step 5: Load event partitions ──
-    print("[5/5] Load event partitions")
-    run_athena_query(
-        athena,
-        f"MSCK REPAIR TABLE {db}.events;",
-        "Scanning S3 for event partitions"
-    )
+    print("[5/6] Load event partitions")
+    load_partitions(athena, "events", partitions)
     print()
 
+    # ── Step 6: Create rollup tables ──
+    print("[6/6] Create rollup tables")
+    rollup_tables = [(name, name, True) for name in DAILY_ROLLUPS] + [
+        (name, daily_name, False) for name, daily_name in MONTHLY_ROLLUPS.items()
+    ]
+    if args.recreate:
+        for name, _, _ in rollup_tables:
+            drop_table(athena, name)
+    futures = [
+        athena.submit(rollup_table_ddl(name, ROLLUP_COLUMNS[columns], daily))
+        for name, columns, daily in rollup_tables
+    ]
+    for (name, _, _), future in zip(rollup_tables, futures):
+        print(f"  Running: Creating {name} table...")
+        report_execution(future.result())
+    if not config.ATHENA_PARTITION_PROJECTION:
+        for name, _, _ in rollup_tables:
+            load_partitions(athena, name, partitions)
+    print()
+
+    athena.shutdown()
+
     print("=" * 55)
     print("  Athena setup complete!")
     print(f"  Database: {db}")
-    print(f"  Tables: orders, events")
+    print(f"  Tables: orders, events + {len(DAILY_ROLLUPS) + len(MONTHLY_ROLLUPS)} rollups")
     print("=" * 55)
 
 
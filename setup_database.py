@@ -5,6 +5,10 @@ from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import config
 
 
+# Tables created by this script (also checked by verify_backup.py)
+TABLES = ["users", "orders", "events"]
+
+
 def create_database():
     """Create the database if it doesn't exist."""
     print(f"Connecting to PostgreSQL at {config.DB_HOST}:{config.DB_PORT}...")
@@ -140,7 +144,7 @@ def create_tables():
     print(f"  Inserted {len(events)} events")
 
     # ── Show counts ──
-    for table in ["users", "orders", "events"]:
+    for table in TABLES:
         cursor.execute(f"SELECT COUNT(*) FROM {table}")
         count = cursor.fetchone()[0]
         print(f"   {table}: {count} rows")
@@ -0,0 +1,6 @@
+
+import os
+import sys
+
+# The project is a set of top-level scripts; make them importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
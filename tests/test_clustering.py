@@ -0,0 +1,70 @@
+
+import random
+
+import pyarrow as pa
+import pytest
+
+from clustering import cluster_table, merge_sorted_runs
+
+
+KEYS = ["status", "user_id"]
+
+
+def sample(rows=600, seed=7):
+    """Rows with repeated keys and nulls in both key columns."""
+    rng = random.Random(seed)
+    return pa.table({
+        "status": [rng.choice(["completed", "pending", "refunded", None]) for _ in range(rows)],
+        "user_id": [rng.choice([1, 2, 3, 40, None]) for _ in range(rows)],
+        "id": list(range(rows)),
+    })
+
+
+def as_runs(table, run_rows, batch_rows):
+    """Sorted runs of run_rows each, every run yielded in batch_rows slices."""
+    runs = []
+    for start in range(0, len(table), run_rows):
+        run = cluster_table(table.slice(start, run_rows), KEYS, "sort")
+        runs.append([
+            run.slice(offset, batch_rows) for offset in range(0, len(run), batch_rows)
+        ])
+    return runs
+
+
+def key_rows(table):
+    columns = [table.column(key).to_pylist() for key in KEYS]
+    return list(zip(*columns))
+
+
+@pytest.mark.parametrize("run_rows,batch_rows", [(100, 7), (250, 64), (600, 600)])
+def test_merge_matches_sort_by_with_nulls(run_rows, batch_rows):
+    table = sample()
+    merged = pa.concat_tables(merge_sorted_runs(as_runs(table, run_rows, batch_rows), KEYS))
+
+    expected = table.sort_by([(key, "ascending") for key in KEYS])
+    assert key_rows(merged) == key_rows(expected)
+    assert sorted(merged.column("id").to_pylist()) == list(range(len(table)))
+
+
+def test_batch_ending_in_nulls_does_not_hold_back_other_runs():
+    first = pa.table({"status": ["a", None], "user_id": [1, 1], "id": [0, 1]})
+    second = pa.table({"status": ["b", "c"], "user_id": [1, 1], "id": [2, 3]})
+    merged = pa.concat_tables(merge_sorted_runs([[first], [second]], KEYS))
+    assert merged.column("status").to_pylist() == ["a", "b", "c", None]
+
+
+def test_dictionary_keys():
+    table = sample()
+    encoded = table.set_column(
+        0, "status", table.column("status").dictionary_encode()
+    )
+
+    clustered = cluster_table(encoded, KEYS, "sort")
+    expected = table.sort_by([(key, "ascending") for key in KEYS])
+    assert key_rows(clustered) == key_rows(expected)
+
+    merged = pa.concat_tables(merge_sorted_runs(as_runs(encoded, 150, 20), KEYS))
+    assert key_rows(merged) == key_rows(expected)
+
+    zordered = cluster_table(encoded, KEYS, "zorder")
+    assert sorted(zordered.column("id").to_pylist()) == list(range(len(table)))
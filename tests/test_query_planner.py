@@ -0,0 +1,142 @@
+
+from datetime import date, timedelta
+
+import pytest
+
+from query_planner import plan_query
+
+
+FILE_SIZE = 1000
+
+
+@pytest.fixture
+def lake(tmp_path):
+    """orders and events with one 1000-byte file per day, 2025-01-25..02-05."""
+    day = date(2025, 1, 25)
+    while day <= date(2025, 2, 5):
+        for table in ("orders", "events"):
+            directory = tmp_path / table / f"year={day.year}" / \
+                f"month={day.month:02d}" / f"day={day.day:02d}"
+            directory.mkdir(parents=True)
+            (directory / "part-00000.parquet").write_bytes(b"\0" * FILE_SIZE)
+        day += timedelta(days=1)
+    return str(tmp_path)
+
+
+def days(plan, table):
+    return sorted(p for p in plan["partitions"] if p.startswith(f"{table}/"))
+
+
+def test_single_table_equality(lake):
+    plan = plan_query(
+        "SELECT * FROM saas_datalake.orders WHERE year = 2025 AND month = 1 AND day = 30",
+        local_root=lake,
+    )
+    assert days(plan, "orders") == ["orders/year=2025/month=01/day=30"]
+    assert plan["bytes"] == FILE_SIZE
+    assert plan["prefixes"] == [f"{lake}/orders/year=2025/month=01/day=30/"]
+    assert not plan["rewritten"]
+
+
+def test_between_across_months(lake):
+    plan = plan_query(
+        "SELECT * FROM orders WHERE created_at BETWEEN TIMESTAMP '2025-01-30 00:00:00' "
+        "AND TIMESTAMP '2025-02-02 23:59:59'",
+        local_root=lake,
+    )
+    assert plan["rewritten"]
+    assert "(year = 2025 AND month = 1 AND day BETWEEN 30 AND 31)" in plan["query"]
+    assert "(year = 2025 AND month = 2 AND day BETWEEN 1 AND 2)" in plan["query"]
+    assert len(days(plan, "orders")) == 4
+
+
+def test_day_between_on_partition_column(lake):
+    plan = plan_query(
+        "SELECT * FROM orders WHERE year = 2025 AND month = 2 AND day BETWEEN 1 AND 3",
+        local_root=lake,
+    )
+    assert len(days(plan, "orders")) == 3
+
+
+def test_or_is_not_used_to_narrow(lake):
+    plan = plan_query(
+        "SELECT * FROM orders WHERE year = 2025 AND (month = 1 OR status = 'completed')",
+        local_root=lake,
+    )
+    assert len(days(plan, "orders")) == 12
+
+    plan = plan_query(
+        "SELECT * FROM orders WHERE day = 30 OR day = 31", local_root=lake
+    )
+    assert len(days(plan, "orders")) == 12
+
+
+def test_join_only_narrows_the_qualified_table(lake):
+    plan = plan_query(
+        "SELECT * FROM orders o JOIN events e ON o.user_id = e.user_id "
+        "WHERE o.year = 2025 AND o.month = 1 AND o.day = 30",
+        local_root=lake,
+    )
+    assert days(plan, "orders") == ["orders/year=2025/month=01/day=30"]
+    assert len(days(plan, "events")) == 12
+    assert f"{lake}/events/" in plan["prefixes"]
+    assert plan["bytes"] == 13 * FILE_SIZE
+
+
+def test_join_unqualified_filter_is_a_full_scan(lake):
+    plan = plan_query(
+        "SELECT * FROM orders o JOIN events e ON o.user_id = e.user_id "
+        "WHERE day = 30",
+        local_root=lake,
+    )
+    assert len(plan["partitions"]) == 24
+
+
+def test_join_created_at_rewrite_is_qualified(lake):
+    query = (
+        "SELECT COUNT(*) FROM orders o JOIN events e ON o.user_id = e.user_id "
+        "WHERE o.created_at >= TIMESTAMP '2025-01-30 00:00:00' "
+        "AND o.created_at < TIMESTAMP '2025-02-01 00:00:00'"
+    )
+    plan = plan_query(query, local_root=lake)
+    assert plan["rewritten"]
+    assert "(o.year = 2025 AND o.month = 1 AND o.day BETWEEN 30 AND 31)" in plan["query"]
+    assert len(days(plan, "orders")) == 2
+    assert len(days(plan, "events")) == 12
+
+
+def test_extract_from_is_not_a_table(lake):
+    plan = plan_query(
+        "SELECT EXTRACT(hour FROM created_at) AS h FROM orders "
+        "WHERE year = 2025 AND month = 2",
+        local_root=lake,
+    )
+    assert plan["tables"] == ["orders"]
+    assert len(days(plan, "orders")) == 5
+
+
+def test_only_narrowed_prefixes_are_listed(monkeypatch):
+    listed = []
+
+    def list_objects(s3, prefix):
+        listed.append(prefix)
+        return [{"Key": f"{prefix}day=30/part-00000.parquet", "Size": FILE_SIZE}]
+
+    monkeypatch.setattr("query_planner.load_upload_manifest", lambda: {})
+    monkeypatch.setattr("query_planner.list_objects", list_objects)
+    plan = plan_query(
+        "SELECT * FROM orders WHERE year = 2025 AND month = 1", s3=object()
+    )
+    assert listed == ["datalake/orders/year=2025/month=01/"]
+    assert days(plan, "orders") == ["orders/year=2025/month=01/day=30"]
+
+
+def test_manifest_is_filtered_by_prefix(monkeypatch):
+    manifest = {
+        f"orders/year=2025/month={month:02d}/day=01/part-00000.parquet": {"size": FILE_SIZE}
+        for month in (1, 2)
+    }
+    monkeypatch.setattr("query_planner.load_upload_manifest", lambda: manifest)
+    plan = plan_query("SELECT * FROM orders WHERE year = 2025 AND month = 2")
+    assert days(plan, "orders") == ["orders/year=2025/month=02/day=01"]
+    assert plan["bytes"] == FILE_SIZE
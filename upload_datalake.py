@@ -1,43 +1,324 @@
 
 import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 import config
+from partitions import partition_of, write_partitions_file
+from s3_utils import delete_keys, list_objects
+
+
+# compact_datalake.py stages new files here, outside every table location
+STAGING_DIR = "_staging"
+
+
+def s3_upload_client():
+    """One S3 client whose connection pool is sized for the whole upload."""
+    connections = config.DATALAKE_UPLOAD_WORKERS * config.DATALAKE_MULTIPART_CONCURRENCY
+    return boto3.client(
+        "s3",
+        region_name=config.REGION,
+        config=Config(max_pool_connections=max(10, connections))
+    )
+
+
+def transfer_config():
+    """Multipart settings for large Parquet files."""
+    mb = 1024 * 1024
+    return TransferConfig(
+        multipart_threshold=config.DATALAKE_MULTIPART_THRESHOLD_MB * mb,
+        multipart_chunksize=config.DATALAKE_MULTIPART_CHUNK_MB * mb,
+        max_concurrency=config.DATALAKE_MULTIPART_CONCURRENCY
+    )
+
+
+def scan_files(local_dir):
+    """Yield (local_path, relative_path, stat) for every file under local_dir.
+
+    Uses os.scandir so each file is stat'ed exactly once.
+    """
+    stack = [local_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    relative_path = os.path.relpath(entry.path, local_dir)
+                    yield entry.path, relative_path.replace(os.sep, "/"), entry.stat()
+
+
+class TransferProgress:
+    """Thread-safe counters with a periodic aggregate MB/s and files/s line."""
+
+    def __init__(self, total_files, total_bytes, interval=None):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval or config.PROGRESS_INTERVAL_SECONDS
+        self.files = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._report_loop, daemon=True)
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes += count
+
+    def file_done(self):
+        with self._lock:
+            self.files += 1
+
+    def line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        mb = self.bytes / (1024 * 1024)
+        return (
+            f"  {self.files:,}/{self.total_files:,} files, "
+            f"{mb:,.1f}/{self.total_bytes / (1024 * 1024):,.1f} MB "
+            f"| {mb / elapsed:,.1f} MB/s, {self.files / elapsed:,.1f} files/s"
+        )
+
+    def _report_loop(self):
+        while not self._stop.wait(self.interval):
+            print(self.line())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        print(self.line())
+
+
+def upload_files(s3, files, s3_prefix):
+    """Upload (local_path, relative_path, size) tuples on a thread pool.
+
+    Returns (uploaded, failed): lists of the tuples that succeeded / failed.
+    """
+    total_bytes = sum(size for _, _, size in files)
+    transfer = transfer_config()
+    uploaded = []
+    failed = []
+
+    def upload(local_path, relative_path, progress):
+        s3.upload_file(
+            Filename=local_path,
+            Bucket=config.BUCKET_NAME,
+            Key=f"{s3_prefix}/{relative_path}",
+            Config=transfer,
+            Callback=progress.add_bytes
+        )
+        progress.file_done()
+
+    with TransferProgress(len(files), total_bytes) as progress:
+        with ThreadPoolExecutor(max_workers=config.DATALAKE_UPLOAD_WORKERS) as pool:
+            futures = {}
+            for item in files:
+                local_path, relative_path, _ = item
+                futures[pool.submit(upload, local_path, relative_path, progress)] = item
+
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    future.result()
+                    uploaded.append(item)
+                except Exception as e:
+                    print(f"  ✗ {item[1]}: {e}")
+                    failed.append(item)
+
+    return uploaded, failed
 
 
 def upload_directory(local_dir, s3_prefix):
-    """Upload an entire directory to S3, preserving structure."""
+    """Upload an entire directory to S3, preserving structure.
+
+    Returns (files uploaded, bytes uploaded, files failed).
+    """
     print(f"Uploading {local_dir}/ → s3://{config.BUCKET_NAME}/{s3_prefix}/")
+    print(f"  {config.DATALAKE_UPLOAD_WORKERS} workers, multipart above "
+          f"{config.DATALAKE_MULTIPART_THRESHOLD_MB} MB")
     print()
 
-    s3 = boto3.client("s3", region_name=config.REGION)
-    uploaded_count = 0
-    total_size = 0
+    s3 = s3_upload_client()
+
+    # Build S3 keys by replacing local_dir with s3_prefix
+    # Example: output/orders/year=2025/... → datalake/orders/year=2025/...
+    files = [
+        (local_path, relative_path, stat.st_size)
+        for local_path, relative_path, stat in scan_files(local_dir)
+    ]
+
+    uploaded, failed = upload_files(s3, files, s3_prefix)
+    if failed:
+        print(f"  ✗ {len(failed)} file(s) failed to upload")
+
+    stale = stale_partition_keys(s3, s3_prefix, files, failed)
+    if stale:
+        delete_keys(s3, stale)
+        print(f"  Deleted {len(stale):,} stale remote file(s) in uploaded partitions")
+
+    return len(uploaded), sum(size for _, _, size in uploaded), len(failed)
+
+
+def stale_partition_keys(s3, s3_prefix, files, failed):
+    """Remote keys in the uploaded partitions that aren't local files.
+
+    A partition is uploaded as a whole, so anything else under it is
+    left over from an earlier layout (e.g. data.parquet from before the
+    part-NNNNN.parquet writer) and would be read twice by Athena.
+    Partitions with a failed upload are left alone.
+    """
+    local = {relative_path for _, relative_path, _ in files}
+    partitions = {partition_of(path) for path in local} - {None}
+    partitions -= {partition_of(path) for _, path, _ in failed}
+    stale = []
+    for obj in list_objects(s3, f"{s3_prefix}/"):
+        path = obj["Key"][len(s3_prefix) + 1:]
+        if path not in local and partition_of(path) in partitions:
+            stale.append(obj["Key"])
+    return stale
 
-    # Walk through all files in the directory
-    for root, dirs, files in os.walk(local_dir):
-        for filename in files:
-            # Full local path
-            local_path = os.path.join(root, filename)
 
-            # Build S3 key by replacing local_dir with s3_prefix
-            # Example: output/orders/year=2025/... → datalake/orders/year=2025/...
-            relative_path = os.path.relpath(local_path, local_dir)
-            s3_key = f"{s3_prefix}/{relative_path}"
+def file_md5(path):
+    """MD5 of a file, read in 1 MB blocks."""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-            # Upload
-            file_size = os.path.getsize(local_path)
-            print(f"{s3_key} ({file_size:,} bytes)")
 
-            s3.upload_file(
-                Filename=local_path,
-                Bucket=config.BUCKET_NAME,
-                Key=s3_key
-            )
+def load_upload_manifest():
+    """Local record of uploaded files: relative path → size/mtime/md5/etag."""
+    if not os.path.exists(config.UPLOAD_MANIFEST_FILE):
+        return {}
+    with open(config.UPLOAD_MANIFEST_FILE) as f:
+        return json.load(f)
 
-            uploaded_count += 1
-            total_size += file_size
 
-    return uploaded_count, total_size
+def save_upload_manifest(manifest):
+    with open(config.UPLOAD_MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def is_unchanged(entry, md5, remote):
+    """True if the remote object already holds this exact file."""
+    if remote is None or remote["Size"] != entry["size"]:
+        return False
+    etag = remote["ETag"].strip('"')
+    if "-" not in etag:
+        # Single-part upload: the ETag is the content MD5
+        return etag == md5
+    # Multipart ETags aren't an MD5; trust the ETag recorded at upload time
+    return entry.get("md5") == md5 and entry.get("etag") == etag
+
+
+def sync_directory(local_dir, s3_prefix, delete=False):
+    """Upload only new or changed files, optionally deleting remote extras.
+
+    Local files are compared against one paginated listing of s3_prefix.
+    delete only removes extras under tables that exist locally, and never
+    touches compaction's in-flight STAGING_DIR.
+    File hashes are cached in UPLOAD_MANIFEST_FILE and only recomputed when
+    size or mtime changed. The partitions that were uploaded to or deleted
+    from are written to TOUCHED_PARTITIONS_FILE for incremental downstream
+    steps (Athena partition registration).
+    Returns (files uploaded, bytes uploaded, files failed).
+    """
+    print(f"Syncing {local_dir}/ → s3://{config.BUCKET_NAME}/{s3_prefix}/")
+    print()
+
+    s3 = s3_upload_client()
+    manifest = load_upload_manifest()
+    remote = {
+        obj["Key"][len(s3_prefix) + 1:]: obj
+        for obj in list_objects(s3, f"{s3_prefix}/")
+        if not obj["Key"].startswith(f"{s3_prefix}/{STAGING_DIR}/")
+    }
+    local = {
+        relative_path: (local_path, stat)
+        for local_path, relative_path, stat in scan_files(local_dir)
+    }
+
+    # Reuse cached hashes; hash changed files in parallel
+    def current_entry(relative_path):
+        local_path, stat = local[relative_path]
+        cached = manifest.get(relative_path, {})
+        if (cached.get("size") == stat.st_size
+                and cached.get("mtime_ns") == stat.st_mtime_ns):
+            md5 = cached["md5"]
+        else:
+            md5 = file_md5(local_path)
+        return relative_path, {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "md5": md5,
+            "etag": cached.get("etag") if cached.get("md5") == md5 else None,
+        }
+
+    with ThreadPoolExecutor(max_workers=config.DATALAKE_UPLOAD_WORKERS) as pool:
+        entries = dict(pool.map(current_entry, local))
+
+    changed = [
+        (local[path][0], path, entry["size"])
+        for path, entry in entries.items()
+        if not is_unchanged(entry, entry["md5"], remote.get(path))
+    ]
+    # Only tables that exist locally are mirrored; S3-only tables are left alone
+    local_tables = {path.split("/")[0] for path in local if "/" in path}
+    extra = [
+        path for path in remote
+        if path not in local and path.split("/")[0] in local_tables
+    ]
+    print(f"  {len(local):,} local file(s), {len(remote):,} remote: "
+          f"{len(changed):,} to upload, {len(local) - len(changed):,} unchanged")
+
+    uploaded, failed = upload_files(s3, changed, s3_prefix) if changed else ([], [])
+    if failed:
+        print(f"  ✗ {len(failed)} file(s) failed to upload")
+
+    # Record the ETag S3 now holds for every synced file
+    threshold = config.DATALAKE_MULTIPART_THRESHOLD_MB * 1024 * 1024
+    uploaded_paths = {path for _, path, _ in uploaded}
+    for path, entry in list(entries.items()):
+        if path in uploaded_paths and entry["size"] >= threshold:
+            # Multipart ETags have to be read back from S3
+            head = s3.head_object(Bucket=config.BUCKET_NAME, Key=f"{s3_prefix}/{path}")
+            entry["etag"] = head["ETag"].strip('"')
+        elif path in uploaded_paths:
+            entry["etag"] = entry["md5"]
+        elif is_unchanged(entry, entry["md5"], remote.get(path)):
+            entry["etag"] = remote[path]["ETag"].strip('"')
+        else:
+            del entries[path]  # failed upload, retried next run
+    save_upload_manifest(entries)
+
+    deleted = []
+    if delete and extra:
+        delete_keys(s3, [f"{s3_prefix}/{path}" for path in extra])
+        deleted = extra
+        print(f"  Deleted {len(deleted):,} remote file(s) no longer present locally")
+    elif extra:
+        print(f"  {len(extra):,} remote file(s) not present locally (use --delete)")
+
+    touched = {
+        partition_of(path)
+        for path in [p for _, p, _ in uploaded] + deleted
+    } - {None}
+    partitions_file = write_partitions_file(touched)
+    print(f"  {len(touched)} touched partition(s) → {partitions_file}")
+
+    return len(uploaded), sum(size for _, _, size in uploaded), len(failed)
 
 
 def verify_upload():
@@ -60,6 +341,17 @@ def verify_upload():
         print(f"  {obj['Key']} ({size_kb:.1f} KB)")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload output/ to the data lake")
+    parser.add_argument(
+        "--sync", action="store_true", default=config.DATALAKE_SYNC,
+        help="upload only new or changed files"
+    )
+    parser.add_argument(
+        "--delete", action="store_true",
+        help="with --sync, delete remote files that no longer exist locally"
+    )
+    args = parser.parse_args()
+
     print("=" * 55)
     print("  Uploading Data Lake to S3")
     print("=" * 55)
@@ -70,11 +362,21 @@ if __name__ == "__main__":
         print(" Run generate_data.py first.")
         exit(1)
 
-    count, size = upload_directory("output", config.DATALAKE_PREFIX)
+    if args.sync:
+        count, size, failed = sync_directory(
+            "output", config.DATALAKE_PREFIX, delete=args.delete
+        )
+    else:
+        count, size, failed = upload_directory("output", config.DATALAKE_PREFIX)
 
     verify_upload()
 
     print()
     print("=" * 55)
     print(f"  Uploaded {count} files ({size:,} bytes total)")
-    print("=" * 55)
\ No newline at end of file
+    if failed:
+        print(f"  ✗ {failed} file(s) failed — re-run to retry them")
+    print("=" * 55)
+
+    if failed:
+        exit(1)
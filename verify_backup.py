@@ -0,0 +1,164 @@
+
+import sys
+import time
+
+import boto3
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+import config
+from restore_from_s3 import find_backup, restore_backup
+from setup_database import TABLES
+
+
+def connect(dbname):
+    """Open a connection to a database on the configured server."""
+    return psycopg2.connect(
+        host=config.DB_HOST,
+        port=config.DB_PORT,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        dbname=dbname
+    )
+
+
+def recreate_database(dbname, drop_only=False):
+    """Drop the scratch database and (unless drop_only) create it empty."""
+    conn = connect("postgres")
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(dbname)))
+    if not drop_only:
+        cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
+    cursor.close()
+    conn.close()
+
+
+def table_stats(conn, table, max_id=None):
+    """Row count, max id and a checksum over a deterministic sample of rows.
+
+    The sample is every row whose id is a multiple of VERIFY_SAMPLE_EVERY.
+    When max_id is given, only rows up to it are considered, so rows
+    inserted into the source after the dump was taken are ignored.
+    """
+    where = "" if max_id is None else f"WHERE id <= {int(max_id)}"
+    sample_where = f"id % {config.VERIFY_SAMPLE_EVERY} = 0"
+    if max_id is not None:
+        sample_where += f" AND id <= {int(max_id)}"
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*), MAX(id) FROM {table} {where}")
+    count, table_max_id = cursor.fetchone()
+    cursor.execute(f"""
+        SELECT md5(COALESCE(string_agg(t::text, '|' ORDER BY t.id), ''))
+        FROM (SELECT * FROM {table} WHERE {sample_where}) t
+    """)
+    checksum = cursor.fetchone()[0]
+    cursor.close()
+    return count, table_max_id, checksum
+
+
+def source_max_ids():
+    """MAX(id) of every source table; record this before pg_dump starts."""
+    conn = connect(config.DB_NAME)
+    try:
+        cursor = conn.cursor()
+        bounds = {}
+        for table in TABLES:
+            cursor.execute(f"SELECT MAX(id) FROM {table}")
+            bounds[table] = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        conn.close()
+    return bounds
+
+
+def verify_backup(s3_key, source_bounds=None):
+    """Restore a freshly uploaded backup into a scratch DB and compare it.
+
+    source_bounds is source_max_ids() taken before the dump: both sides
+    are compared up to those ids, so an empty or truncated restore shows
+    up as missing rows. Without bounds the restored MAX(id) is used, and
+    an empty restored table is compared with the whole source table.
+    Returns a report dict with per-table results, overall status and the
+    time verification took. Safe to run on a worker thread.
+    """
+    started = time.monotonic()
+    scratch_db = config.VERIFY_DB_NAME
+    report = {"backup": s3_key, "tables": [], "ok": False, "error": None}
+
+    try:
+        s3 = boto3.client("s3", region_name=config.REGION)
+        backup = find_backup(s3, s3_key)
+        if not backup:
+            raise RuntimeError(f"backup {s3_key} not found")
+
+        recreate_database(scratch_db)
+        restore_backup(s3, backup, scratch_db)
+
+        source = connect(config.DB_NAME)
+        restored = connect(scratch_db)
+        try:
+            for table in TABLES:
+                if source_bounds is not None:
+                    bound = source_bounds.get(table) or 0
+                    r_count, _, r_checksum = table_stats(restored, table, max_id=bound)
+                else:
+                    r_count, bound, r_checksum = table_stats(restored, table)
+                s_count, _, s_checksum = table_stats(source, table, max_id=bound)
+                report["tables"].append({
+                    "table": table,
+                    "source_rows": s_count,
+                    "restored_rows": r_count,
+                    "checksum_match": r_checksum == s_checksum,
+                    "ok": r_count == s_count and r_checksum == s_checksum,
+                })
+        finally:
+            source.close()
+            restored.close()
+
+        report["ok"] = all(t["ok"] for t in report["tables"])
+
+    except Exception as e:
+        report["error"] = str(e)
+
+    finally:
+        try:
+            recreate_database(scratch_db, drop_only=True)
+        except Exception:
+            pass
+
+    report["seconds"] = time.monotonic() - started
+    return report
+
+
+def print_report(report):
+    """Print a verification report in the backup script's style."""
+    print(f"\n Backup verification ({report['seconds']:.1f}s):")
+    if report["error"]:
+        print(f"  ✗ Verification failed: {report['error']}")
+        return
+
+    for t in report["tables"]:
+        mark = "✓" if t["ok"] else "✗"
+        checksum = "checksum ok" if t["checksum_match"] else "CHECKSUM MISMATCH"
+        print(f"  {mark} {t['table']}: {t['restored_rows']:,} / "
+              f"{t['source_rows']:,} rows, {checksum}")
+
+    if report["ok"]:
+        print("  ✓ Backup restores cleanly and matches the source")
+    else:
+        print("  ✗ Restored data does not match the source!")
+
+
+if __name__ == "__main__":
+    # Verify a named backup, or the newest one
+    s3 = boto3.client("s3", region_name=config.REGION)
+    backup = find_backup(s3, sys.argv[1] if len(sys.argv) > 1 else None)
+    if not backup:
+        print("No backup found")
+        exit(1)
+
+    report = verify_backup(backup["backup"])
+    print_report(report)
+    exit(0 if report["ok"] else 1)